@@ -0,0 +1,397 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import us_bikeshare_optimized as bikeshare
+import us_bikeshare_submission as submission
+import us_bikeshare_synthetic as synthetic
+
+# Where the synthetic city files are written, under the scripts' data folder
+BENCH_FOLDER = os.path.join("./data", "bench")
+
+# The filter answered by the filtering stages
+BENCH_MONTHS = ["June"]
+BENCH_DAYS = ["Monday"]
+
+# The filters checked by `check_filters()`, including ones matching nothing
+CHECK_MONTHS = [(), (6,), (12,), (1, 2)]
+CHECK_DAYS = [(), (0,), (5, 6)]
+CHECK_DATES = [None, ("2017-03-01", "2017-03-15"), ("2018-01-01", None),
+               (None, "2017-01-01")]
+CHECK_HOURS = [None, (7, 10), (22, 2), (0, 24)]
+
+
+def measure(fn, setup=None, repeat=3):
+    """Times a function & measures the memory it allocates at its peak.
+
+    The function is run `repeat` times untraced for timing, then once more
+    under tracemalloc for its peak allocation; whatever it prints is
+    discarded.
+
+    Args:
+        fn (function): the measured function, called with the output of
+            `setup` if given.
+        setup (function): makes a fresh input for each run, not measured.
+        repeat (int): the number of timed runs.
+
+    Returns:
+        result (dict): the wall time of each run, the best of them in
+            seconds & the peak of the traced run in bytes.
+        output: what the last run of `fn` returned.
+    """
+
+    def run_once():
+        arguments = () if setup is None else (setup(),)
+        with contextlib.redirect_stdout(io.StringIO()):
+            t_0 = time.perf_counter()
+            output = fn(*arguments)
+            return time.perf_counter() - t_0, output
+
+    seconds = []
+    for _ in range(repeat):
+        t_delta, output = run_once()
+        seconds.append(t_delta)
+
+    tracemalloc.start()
+    try:
+        run_once()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": seconds, "best": min(seconds), "peak_bytes": peak}, \
+        output
+
+
+@contextlib.contextmanager
+def answers(*lines):
+    """Feeds lines to the prompts of the interactive functions.
+
+    Args:
+        *lines (str): the answers, one per prompt.
+
+    Yields:
+        This function yields nothing.
+    """
+
+    stdin = sys.stdin
+    sys.stdin = io.StringIO("".join(f"{line}\n" for line in lines))
+    try:
+        yield
+    finally:
+        sys.stdin = stdin
+
+
+def drop_store(path):
+    """Removes the column store of a city file, so it is parsed again.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    shutil.rmtree(bikeshare.cache_path(path), ignore_errors=True)
+
+
+def bench_optimized(path, repeat):
+    """Measures each stage of us_bikeshare_optimized.py on a city file.
+
+    Args:
+        path (str): path to the city CSV file.
+        repeat (int): the number of timed runs of each stage.
+
+    Returns:
+        stages (dict): the measurements of each stage, see `measure()`.
+    """
+
+    stages = {}
+    stages["load_csv"], _ = measure(lambda: bikeshare.read_csv_file(path),
+                                    repeat=repeat)
+    stages["load_cold"], _ = measure(
+        lambda _: bikeshare.read_city_data(path),
+        setup=lambda: drop_store(path), repeat=repeat,
+    )
+    stages["load"], raw_data = measure(lambda: bikeshare.read_city_data(path),
+                                       repeat=repeat)
+    stages["get_data_ready"], data = measure(
+        lambda raw: bikeshare.get_data_ready(raw),
+        setup=lambda: raw_data.copy(deep=False), repeat=repeat,
+    )
+
+    def filter_data():
+        with answers(" ".join(BENCH_MONTHS + BENCH_DAYS)):
+            return bikeshare.filter_data(data)
+
+    stages["filter_data"], _ = measure(filter_data, repeat=repeat)
+    stages["build_cube"], cube = measure(lambda: bikeshare.build_cube(data),
+                                         repeat=repeat)
+    months = [bikeshare.MONTHS.index(m) + 1 for m in BENCH_MONTHS]
+    days = [bikeshare.DAYS.index(d) for d in BENCH_DAYS]
+    stages["query_cube"], _ = measure(
+        lambda: bikeshare.query_cube(cube, months, days), repeat=repeat,
+    )
+    stages["summarize"], summary = measure(lambda: bikeshare.summarize(data),
+                                           repeat=repeat)
+    stages["describe"], stats = measure(lambda: bikeshare.describe(summary),
+                                        repeat=repeat)
+    for name in ("time_stats", "station_stats", "trip_duration_stats",
+                 "user_stats"):
+        printer = getattr(bikeshare, name)
+        stages[name], _ = measure(lambda: printer(stats), repeat=repeat)
+    return stages
+
+
+def bench_submission(path, repeat):
+    """Measures each stage of us_bikeshare_submission.py on a city file.
+
+    Its loading also processes the data, as `get_data_ready()` would, and
+    each numbered statistic is measured on its own.
+
+    Args:
+        path (str): path to the city CSV file.
+        repeat (int): the number of timed runs of each stage.
+
+    Returns:
+        stages (dict): the measurements of each stage, see `measure()`.
+    """
+
+    # loading_func() reads the files of its cities from ./data/
+    cities = {"Bench": os.path.relpath(path, "./data")}
+
+    def load():
+        with answers("Bench", ""):
+            return submission.loading_func(cities)[1]
+
+    stages = {}
+    stages["loading_func"], data = measure(load, repeat=repeat)
+
+    def filtering_func():
+        with answers("y", " ".join(BENCH_DAYS), " ".join(BENCH_MONTHS)):
+            return submission.filtering_func(data)
+
+    stages["filtering_func"], _ = measure(filtering_func, repeat=repeat)
+    stages["computing_statistics"], _ = measure(
+        lambda: submission.computing_statistics(submission.options, data),
+        repeat=repeat,
+    )
+    for number, option in submission.options.items():
+        stages[f"statistic_{number}"], _ = measure(
+            lambda: submission.computing_statistics({number: option}, data),
+            repeat=repeat,
+        )
+    return stages
+
+
+def check_filters(path):
+    """Checks the time index filters against a plain scan of the trips.
+
+    Every combination of the CHECK_ filters is answered by
+    `select_ranges()` & `slice_ranges()`, then by `match_rows()`.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        mismatches (list): the filters whose trips differ.
+    """
+
+    data = bikeshare.get_data_ready(bikeshare.read_city_data(path),
+                                    verbose=False)
+    index = bikeshare.build_time_index(data)
+    mismatches = []
+    for months, days, dates, hours in itertools.product(
+        CHECK_MONTHS, CHECK_DAYS, CHECK_DATES, CHECK_HOURS
+    ):
+        if dates is not None:
+            dates = tuple(None if day is None else np.datetime64(day)
+                          for day in dates)
+        ranges = bikeshare.select_ranges(index, months, days, dates, hours)
+        found = bikeshare.slice_ranges(index, ranges)
+        expected = bikeshare.match_rows(index["data"], months, days, dates,
+                                        hours)
+        if not found.index.equals(expected.index):
+            mismatches.append((months, days, dates, hours))
+    return mismatches
+
+
+def run_benchmarks(rows, cities, scripts, repeat=3, seed=0, check=False):
+    """Measures the scripts on synthetic city files of several sizes.
+
+    Missing files are generated first, existing ones are reused.
+
+    Args:
+        rows (list): the numbers of trips of the files.
+        cities (list): keys of synthetic.CITY_SHAPES.
+        scripts (list): "optimized" and/or "submission".
+        repeat (int): the number of timed runs of each stage.
+        seed (int): the seed of the synthetic files.
+        check (bool): whether to first check the filters on each file, see
+            `check_filters()`.
+
+    Returns:
+        results (dict): the environment & one record per measured stage.
+
+    Raises:
+        AssertionError: if a checked filter gives the wrong trips.
+    """
+
+    benches = {"optimized": bench_optimized, "submission": bench_submission}
+    records = []
+    for n_rows in rows:
+        for city in cities:
+            name = os.path.basename(bikeshare.CITIES[city])
+            path = os.path.join(BENCH_FOLDER, f"{n_rows}", name)
+            if not os.path.exists(path):
+                print(f"Writing {n_rows} {city} trips..", file=sys.stderr)
+                synthetic.generate_city(path, city, n_rows, seed)
+            if check:
+                print(f"Checking the filters on {path}..", file=sys.stderr)
+                mismatches = check_filters(path)
+                assert not mismatches, f"wrong trips for {mismatches}"
+
+            for script in scripts:
+                print(f"Measuring {script} on {path}..", file=sys.stderr)
+                stages = benches[script](path, repeat)
+                records.extend(
+                    {"script": script, "city": city, "rows": n_rows,
+                     "stage": stage, **result}
+                    for stage, result in stages.items()
+                )
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "pyarrow": getattr(bikeshare.pyarrow, "__version__", None),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "repeat": repeat,
+        "results": records,
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    """Compares measurements with those of an earlier run.
+
+    Args:
+        results (dict): the output of `run_benchmarks()`.
+        baseline (dict): an earlier output of `run_benchmarks()`.
+        tolerance (float): how much slower than the baseline a stage may
+            get, e.g. 0.25 for 25%.
+
+    Returns:
+        regressions (list): the records slower than their baseline, each
+            with its `baseline` best time & `ratio` to it.
+    """
+
+    def key(record):
+        return record["script"], record["city"], record["rows"], record["stage"]
+
+    before = {key(record): record["best"] for record in baseline["results"]}
+    regressions = []
+    for record in results["results"]:
+        best = before.get(key(record))
+        if best and record["best"] > best * (1 + tolerance):
+            regressions.append({**record, "baseline": best,
+                                "ratio": record["best"] / best})
+    return regressions
+
+
+def print_results(results):
+    """Displays the measurements as a table, on stderr.
+
+    Args:
+        results (dict): the output of `run_benchmarks()`.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    table = pd.DataFrame(results["results"])
+    table["best_ms"] = (table["best"] * 1000).round(3)
+    table["peak_mib"] = (table["peak_bytes"] / 1024**2).round(2)
+    print(table[["script", "city", "rows", "stage", "best_ms", "peak_mib"]]
+          .to_string(index=False), file=sys.stderr)
+
+
+def parse_args(argv=None):
+    """Reads the command line options.
+
+    Args:
+        argv (list): the arguments, those of the script if not given.
+
+    Returns:
+        args (argparse.Namespace): the parsed options.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Measure the scripts' stages on synthetic city files.",
+    )
+    parser.add_argument(
+        "--rows", nargs="+", type=lambda n: int(float(n)), default=[100_000],
+        help="the sizes of the files, e.g. 1e5 1e6",
+    )
+    parser.add_argument(
+        "--cities", nargs="+", type=str.title, choices=synthetic.CITY_SHAPES,
+        default=["Chicago"], metavar="CITY",
+    )
+    parser.add_argument(
+        "--scripts", nargs="+", choices=["optimized", "submission"],
+        default=["optimized", "submission"],
+    )
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="the number of timed runs of each stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--check", action="store_true",
+        help="first check the time index filters against a plain scan",
+    )
+    parser.add_argument("--output",
+                        help="write the JSON results there, not to stdout")
+    parser.add_argument(
+        "--baseline",
+        help="the JSON results of an earlier run to check for regressions",
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25,
+        help="how much slower than the baseline a stage may get",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_benchmarks(args.rows, args.cities, args.scripts,
+                             args.repeat, args.seed, args.check)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = find_regressions(results, json.load(file),
+                                           args.tolerance)
+        for record in regressions:
+            print(f"Regression: {record['script']} {record['city']} "
+                  f"{record['rows']} {record['stage']} took "
+                  f"{record['ratio']:.2f}x its baseline", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -1,6 +1,34 @@
-import datetime as dt
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import io
+import itertools
+import json
+import math
+import os
+import pickle
+import shutil
+import threading
+import time
+import tracemalloc
+
+import numpy as np
 import pandas as pd
 
+try:
+    import fcntl
+    import resource
+except ImportError:  # Windows
+    fcntl = resource = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
 # Declare some CONSTANTS for validating user inputs
 CITIES = {
     "Chicago": "./data/chicago.csv",
@@ -8,175 +36,2708 @@ CITIES = {
     "Washington": "./data/washington.csv",
 }
 
-DAYS = ["Saturday", "Sunday", "Monday",
-        "Tuesday", "Wednesday", "Thursday", "Friday"]
+# Ordered as `dt.dayofweek` numbers them, so that DAYS[day] is its name
+DAYS = ["Monday", "Tuesday", "Wednesday",
+        "Thursday", "Friday", "Saturday", "Sunday"]
+
+MONTHS = [
+    "January",
+    "February",
+    "March",
+    "April",
+    "May",
+    "June",
+    "July",
+    "August",
+    "September",
+    "October",
+    "November",
+    "December",
+]
+
+# Name of the folder, next to each city file, holding its column store
+CACHE_FOLDER = ".cache"
+
+# The columns parsed as timestamps, all written in this one format
+DATE_COLUMNS = ["Start Time", "End Time"]
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# The parsed types of the other known columns, see `read_csv_file()`
+CSV_DTYPES = {
+    "Trip Duration": "float64",
+    "Start Station": "category",
+    "End Station": "category",
+    "User Type": "category",
+    "Gender": "category",
+    "Birth Year": "Int16",
+}
+
+# The columns every summary is made from, then those of some sections only
+CORE_COLUMNS = ["Start Time", "End Time", "Start Station", "End Station",
+                "User Type"]
+SECTION_COLUMNS = {"user": ["Gender", "Birth Year"]}
+
+# The columns of the store partitioned by city, year & month, the same for
+# every city: those a city file lacks are kept as missing values
+PARTITIONS_FOLDER = "partitions"
+STORE_SCHEMA = ["Start Time", "End Time", "Trip Duration", "Start Station",
+                "End Station", "User Type", "Gender", "Birth Year"]
+
+# How many bytes before its end a store checks the source is unchanged
+TAIL_BYTES = 4096
+
+# The statistics of each report section, as named by `describe()`
+REPORT_SECTIONS = {
+    "time": ["most_common_month", "most_common_day", "most_common_hour"],
+    "station": ["most_common_start_station", "most_common_end_station",
+                "most_common_trip", "top_trips", "most_net_arrivals",
+                "most_net_departures"],
+    "duration": ["total_travel_time", "mean_travel_time",
+                 "travel_time_percentiles", "travel_time_histogram",
+                 "travel_time_by_user_type"],
+    "user": ["user_types", "genders", "earliest_birth_year",
+             "most_recent_birth_year", "most_common_birth_year"],
+}
+
+# Where the command line keeps computed statistics between runs
+RESULT_CACHE_FOLDER = os.path.join("./data", CACHE_FOLDER, "results")
+
+# Files larger than this are aggregated chunk by chunk instead of loaded
+STREAMING_SIZE = 2 * 1024**3
+CHUNK_ROWS = 500_000
+
+# The reported travel time percentiles & the bounds of the travel time
+# histogram bins, in minutes
+DURATION_PERCENTILES = [50, 90, 99]
+DURATION_BINS = [0, 5, 10, 15, 20, 30, 45, 60, 120]
+
+# How many of the most common trips are reported
+TOP_TRIPS = 5
+
+# The approximate most common trip: a Count-Min sketch of SKETCH_DEPTH rows
+# of 2**SKETCH_BITS counters, with candidates from a sample of SAMPLE_SIZE
+# trips, see `sketch_trips()`
+SKETCH_BITS = 14
+SKETCH_DEPTH = 4
+SAMPLE_SIZE = 10_000
+SKETCH_HASHES = np.random.default_rng(0).integers(
+    2**62, 2**63, SKETCH_DEPTH, dtype=np.uint64
+) | np.uint64(1)
+
+# The city chosen last, the first one loaded in the background next time
+LAST_CITY_PATH = os.path.join("./data", CACHE_FOLDER, "last_city.txt")
+
+# The background loads of the city files: their fingerprint & future by
+# path, and the threads running them, see `start_prefetch()`
+PREFETCH = {}
+PREFETCH_POOL = None
+
+# How a cursor finds rows in a city file: scanning blocks of this size for
+# line ends, remembering where every ANCHOR_ROWS-th row starts
+SCAN_BYTES = 1024**2
+ANCHOR_ROWS = 10_000
+
+# The spans recorded while tracing, see `start_trace()`; None when off
+TRACE = None
+OPEN_SPANS = threading.local()
+
+# What `span()` hands out while tracing is off, its fields are never read
+UNTRACED = {}
+UNTRACED_SPAN = contextlib.nullcontext(UNTRACED)
+
+# Fixed-width on-disk layout of the known columns, see `write_cache()`
+COLUMN_KINDS = {
+    "Start Time": "timestamp",
+    "End Time": "timestamp",
+    "Start Station": "station",
+    "End Station": "station",
+    "User Type": "category",
+    "Gender": "category",
+    "Birth Year": "year",
+}
+
+
+def start_trace(memory=True):
+    """Starts recording spans, see `span()`.
+
+    Args:
+        memory (bool): whether to also measure the memory allocated within
+            each span, which makes the traced code slower.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    global TRACE
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    TRACE = {"t_0": time.perf_counter_ns(), "memory": memory, "spans": []}
+
+
+def stop_trace():
+    """Stops recording spans.
+
+    Returns:
+        trace (dict): the recorded spans, see `span()`.
+        None: if no trace was started.
+    """
+
+    global TRACE
+    trace, TRACE = TRACE, None
+    if trace is not None and trace["memory"]:
+        tracemalloc.stop()
+    return trace
+
+
+@contextlib.contextmanager
+def record_span(trace, name, fields):
+    """Records one span of a trace, see `span()`.
+
+    Args:
+        trace (dict): the trace the span is added to once it ends.
+        name (str): the name of the span.
+        fields (dict): the first fields of its record.
+
+    Yields:
+        record (dict): the record of the span.
+    """
+
+    depth = getattr(OPEN_SPANS, "depth", 0)
+    OPEN_SPANS.depth = depth + 1
+    record = {"name": name, **fields}
+    memory_0 = tracemalloc.get_traced_memory()[0] if trace["memory"] else 0
+    t_0 = time.perf_counter_ns()
+    try:
+        yield record
+    finally:
+        record["start_ns"] = t_0 - trace["t_0"]
+        record["duration_ns"] = time.perf_counter_ns() - t_0
+        if trace["memory"]:
+            record["memory_delta"] = (tracemalloc.get_traced_memory()[0]
+                                      - memory_0)
+        record["pid"] = os.getpid()
+        record["tid"] = threading.get_ident()
+        record["depth"] = depth
+        OPEN_SPANS.depth = depth
+        trace["spans"].append(record)
+
+
+def span(name, **fields):
+    """Times a block of code as a named span of the current trace.
+
+    The span hands out its record, so the block can add the rows it
+    processed or the bytes it read once it knows them. While tracing is
+    off, a shared do-nothing span is handed out instead.
+
+    Args:
+        name (str): the name of the span, e.g. "parse".
+        **fields: further fields of the record, e.g. `rows`.
+
+    Returns:
+        span (contextlib.AbstractContextManager): the span, entered with
+            `with`; its record gets the start & duration in nanoseconds,
+            the memory allocated in between, the process & thread.
+    """
+
+    if TRACE is None:
+        return UNTRACED_SPAN
+    return record_span(TRACE, name, fields)
+
+
+def traced(name):
+    """Makes each call of the decorated function a span of the trace.
+
+    The span counts the rows of the dataset the function is given, or
+    else of the one it returns.
+
+    Args:
+        name (str): the name of the spans.
+
+    Returns:
+        decorator (function): the decorator.
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper_fn(*args, **kwargs):
+            if TRACE is None:
+                return fn(*args, **kwargs)
+            with span(name) as record:
+                if args and isinstance(args[0], pd.DataFrame):
+                    record["rows"] = len(args[0])
+                output = fn(*args, **kwargs)
+                if "rows" not in record and isinstance(output, pd.DataFrame):
+                    record["rows"] = len(output)
+            return output
+        return wrapper_fn
+    return decorator
+
+
+def write_trace(trace, path, format="json"):
+    """Saves the spans of a trace.
+
+    Args:
+        trace (dict): a trace returned by `stop_trace()`.
+        path (str): where to write it.
+        format (str): "json" for the span records, or "chrome" for the
+            Trace Event Format read by chrome://tracing & Perfetto.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    spans = sorted(trace["spans"], key=lambda record: record["start_ns"])
+    if format == "chrome":
+        fields = ("name", "start_ns", "duration_ns", "pid", "tid", "depth")
+        content = {"traceEvents": [
+            {
+                "name": record["name"],
+                "ph": "X",
+                "ts": record["start_ns"] / 1000,
+                "dur": record["duration_ns"] / 1000,
+                "pid": record["pid"],
+                "tid": record["tid"],
+                "args": {k: v for k, v in record.items() if k not in fields},
+            }
+            for record in spans
+        ], "displayTimeUnit": "ms"}
+    else:
+        content = {"spans": spans}
+    with open(path, "w") as file:
+        json.dump(content, file, indent=1, default=str)
+
+
+def source_fingerprint(path):
+    """Identifies the current version of a source file.
+
+    Args:
+        path (str): path to the source file.
+
+    Returns:
+        fingerprint (tuple): the file size & modification time.
+    """
+
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def cache_path(path):
+    """Locates the column store of a city file.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        store (str): path to the folder holding the column files.
+    """
+
+    folder, file_name = os.path.split(path)
+    return os.path.join(folder, CACHE_FOLDER, file_name)
+
+
+@contextlib.contextmanager
+def store_lock(path, store=None):
+    """Keeps other sessions from writing the column store of a city file.
+
+    Locking is skipped where `fcntl` is not available.
+
+    Args:
+        path (str): path to the city CSV file.
+        store (str): the store to lock, its column store if not given.
+
+    Returns:
+        lock (contextmanager): holds the lock while in use.
+    """
+
+    lock_file = f"{store or cache_path(path)}.lock"
+    os.makedirs(os.path.dirname(lock_file), exist_ok=True)
+    with open(lock_file, "w") as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        yield
+
+
+def read_source_tail(path, offset):
+    """Fingerprints the bytes of a file just before an offset.
+
+    Args:
+        path (str): path to the source file.
+        offset (int): where the fingerprinted bytes end.
+
+    Returns:
+        tail (str): a hash of the last TAIL_BYTES bytes before `offset`.
+    """
+
+    with open(path, "rb") as file:
+        file.seek(max(offset - TAIL_BYTES, 0))
+        tail = file.read(offset - max(offset - TAIL_BYTES, 0))
+    return hashlib.sha1(tail).hexdigest()
+
+
+def csv_columns(columns, sections=None):
+    """Picks the columns of a city file that some report sections need.
+
+    Args:
+        columns (list): the columns of the file, without its index column.
+        sections (list): names of REPORT_SECTIONS, all the columns are
+            kept if not given.
+
+    Returns:
+        columns (list): the columns to read, in file order.
+    """
+
+    if sections is None:
+        return list(columns)
+    needed = set(CORE_COLUMNS).union(
+        *(SECTION_COLUMNS.get(section, []) for section in sections)
+    )
+    return [column for column in columns if column in needed]
+
+
+def read_csv_file(path, columns=None, sections=None, **kwargs):
+    """Parses a city CSV file, or part of one, with the known column types.
+
+    The index column & the columns not asked for are skipped by the
+    parser rather than dropped afterwards, timestamps are parsed with their
+    fixed format, names become categories & birth years nullable integers.
+    The pyarrow engine is used if it is installed, but for chunked reads.
+
+    Args:
+        path (str or file): the city CSV file.
+        columns (list): the columns to read, all but the index column if
+            not given.
+        sections (list): only read the columns these REPORT_SECTIONS need,
+            see `csv_columns()`.
+        **kwargs: further arguments of `pd.read_csv()`.
+
+    Returns:
+        data (pd.DataFrame): the parsed rows, or a reader of chunks of them
+            if `chunksize` is given.
+    """
+
+    if columns is None:
+        columns = pd.read_csv(path, nrows=0).columns[1:]
+        if hasattr(path, "seek"):
+            path.seek(0)
+    columns = csv_columns(columns, sections)
+
+    options = {
+        "usecols": columns,
+        "dtype": {c: CSV_DTYPES[c] for c in columns if c in CSV_DTYPES},
+        "parse_dates": [c for c in DATE_COLUMNS if c in columns],
+        "date_format": DATE_FORMAT,
+    }
+    if "chunksize" in kwargs:
+        return pd.read_csv(path, **options, **kwargs)
+    if pyarrow is not None:
+        options["engine"] = "pyarrow"
+
+    with span("parse", engine=options.get("engine", "c")) as record:
+        data = pd.read_csv(path, **options, **kwargs)[columns]
+        record["rows"] = len(data)
+        record["bytes"] = (os.path.getsize(path) if isinstance(path, str)
+                           else path.tell())
+    return data
+
+
+def code_dtype(table):
+    """Picks the width pandas gives the codes of a categorical.
+
+    Codes stored at that width are decoded without being copied.
+
+    Args:
+        table (list): the names the codes stand for.
+
+    Returns:
+        dtype (np.dtype): the smallest signed integer type pandas uses.
+    """
+
+    for dtype in (np.int8, np.int16, np.int32):
+        if len(table) < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def encode_columns(data, tables):
+    """Converts raw columns into their fixed-width on-disk values.
+
+    Names missing from the code tables are appended to them, so the codes
+    that are already stored keep their meaning.
+
+    Args:
+        data (pd.DataFrame): the raw rows.
+        tables (dict): the station & category names by table, updated in
+            place.
+
+    Returns:
+        columns (list): the kind & values of each column.
+    """
+
+    columns = []
+    for i, column in enumerate(data.columns):
+        series = data[column]
+        kind = COLUMN_KINDS.get(column, "numeric")
+        if kind == "timestamp":
+            values = series.astype("datetime64[ns]").to_numpy().view(np.int64)
+        elif kind in ("station", "category"):
+            table = tables.setdefault("stations" if kind == "station"
+                                      else str(i), [])
+            names = pd.Index(series.dropna().unique())
+            table.extend(names.difference(pd.Index(table)).tolist())
+            values = pd.Index(table).get_indexer(series).astype(
+                code_dtype(table) if kind == "station" else np.int8
+            )
+        elif kind == "year":
+            values = series.fillna(0).to_numpy().astype(np.int16)
+        else:
+            values = series.to_numpy()
+        columns.append((kind, values))
+    return columns
+
+
+def write_meta(store, meta):
+    """Replaces the metadata of a column store in one step.
+
+    Args:
+        store (str): path to the column store.
+        meta (dict): the new metadata.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    with open(os.path.join(store, "meta.json.tmp"), "w") as file:
+        json.dump(meta, file)
+    os.replace(os.path.join(store, "meta.json.tmp"),
+               os.path.join(store, "meta.json"))
+
+
+def read_meta(path):
+    """Reads the metadata of the column store of a city file.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        meta (dict): the metadata, see `write_cache()`.
+        None: if there is no complete store.
+    """
+
+    try:
+        with open(os.path.join(cache_path(path), "meta.json")) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+@traced("write_store")
+def write_cache(data, path, fingerprint):
+    """Saves a loaded dataset as a store of fixed-width column files.
+
+    Timestamps are kept as int64 epoch nanoseconds, stations as codes into
+    one table shared by start & end stations, as wide as pandas makes
+    them so that they are mapped without a copy (int16 for a few hundred
+    stations), categories as int8 codes
+    and birth years as int16 with 0 marking a missing year. Each column is
+    a raw binary file, while `meta.json` holds the number of rows, the code
+    tables & where the store stands in the source file.
+
+    Args:
+        data (pd.DataFrame): the dataset read from `path`.
+        path (str): path to the city CSV file.
+        fingerprint (tuple): the fingerprint of the file that was read.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    store = cache_path(path)
+    building = f"{store}.{os.getpid()}.tmp"
+    os.makedirs(building, exist_ok=True)
+
+    # Seed the station table sorted, as interning would have it
+    station_columns = [c for c in data.columns if COLUMN_KINDS.get(c) == "station"]
+    tables = {"stations": pd.Index(
+        pd.unique(data[station_columns].to_numpy().ravel())
+    ).dropna().sort_values().tolist()}
+
+    dtypes, kinds = [], []
+    for i, (kind, values) in enumerate(encode_columns(data, tables)):
+        values.tofile(os.path.join(building, f"{i}.bin"))
+        dtypes.append(values.dtype.str)
+        kinds.append(kind)
+
+    with open(path, "rb") as file:
+        header = file.readline().decode()
+    write_meta(building, {
+        "source": list(fingerprint),
+        "offset": fingerprint[0],
+        "tail": read_source_tail(path, fingerprint[0]),
+        "header": header,
+        "rows": len(data),
+        "columns": list(data.columns),
+        "kinds": kinds,
+        "dtypes": dtypes,
+        "tables": tables,
+    })
+
+    # Swap the stores, a replaced one lives on while it's memory-mapped
+    if os.path.exists(store):
+        os.replace(store, f"{building}.old")
+        shutil.rmtree(f"{building}.old", ignore_errors=True)
+    os.replace(building, store)
+
+
+@traced("append_store")
+def append_to_cache(path):
+    """Adds the rows appended to a city file since its store was written.
+
+    Only the new bytes are parsed & encoded, then added to the end of the
+    column files; sessions that mapped the store keep their rows. The
+    store's lock must be held.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        delta (pd.DataFrame): the new rows, as `read_csv_file()` reads them.
+        None: if there is no store or the file changed other than by
+            appending rows.
+    """
+
+    meta = read_meta(path)
+    fingerprint = source_fingerprint(path)
+    if meta is None or fingerprint[0] <= meta["offset"]:
+        return None
+    if read_source_tail(path, meta["offset"]) != meta["tail"]:
+        return None
+
+    # Only parse complete lines, the file may still be being written
+    with open(path, "rb") as file:
+        file.seek(meta["offset"] - 1)
+        new_bytes = file.read(fingerprint[0] - meta["offset"] + 1)
+    if not new_bytes.startswith(b"\n"):
+        return None
+    new_bytes = new_bytes[1:new_bytes.rfind(b"\n") + 1]
+    delta = read_csv_file(io.BytesIO(meta["header"].encode() + new_bytes))
+    if list(delta.columns) != meta["columns"]:
+        return None
+
+    # Cut off what an interrupted append may have left past the stored
+    # rows, so the new rows line up with the others
+    store = cache_path(path)
+    columns = encode_columns(delta, meta["tables"])
+    station_dtype = code_dtype(meta["tables"]["stations"])
+    if any(kind == "station" and np.dtype(meta["dtypes"][i]) != station_dtype
+           for i, kind in enumerate(meta["kinds"])):
+        # Too many new stations for the width of the stored codes
+        return None
+    for i, (_, values) in enumerate(columns):
+        dtype = np.dtype(meta["dtypes"][i])
+        column = os.path.join(store, f"{i}.bin")
+        os.truncate(column, meta["rows"] * dtype.itemsize)
+        with open(column, "ab") as file:
+            values.astype(dtype).tofile(file)
+
+    meta["offset"] += len(new_bytes)
+    if meta["offset"] == fingerprint[0]:
+        meta["source"] = list(fingerprint)
+    meta["tail"] = read_source_tail(path, meta["offset"])
+    meta["rows"] += len(delta)
+    write_meta(store, meta)
+    return delta
+
+
+def read_cache(path):
+    """Opens the column store of a dataset if it is up to date.
+
+    The column files are memory-mapped rather than read, so sessions
+    analyzing the same city share the page cache instead of holding
+    private copies.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        cached_data (pd.DataFrame): the dataset backed by the store.
+        None: if the store is missing or behind the file.
+    """
+
+    meta = read_meta(path)
+    if meta is None or meta["source"] != list(source_fingerprint(path)):
+        return None
+    return read_store_rows(path, meta)
+
+
+def read_store_rows(path, meta, start=0, stop=None):
+    """Decodes a range of rows of the column store of a city file.
+
+    Only that range of each column file is memory-mapped, so a page of a
+    large store costs as little as a page of a small one.
+
+    Args:
+        path (str): path to the city CSV file.
+        meta (dict): the metadata of its store, see `read_meta()`.
+        start (int): the first row of the range.
+        stop (int): the row after the last one, the end if not given.
+
+    Returns:
+        data (pd.DataFrame): the rows, backed by the store.
+    """
+
+    return decode_store(cache_path(path), meta, start, stop)
+
+
+def decode_store(store, meta, start=0, stop=None, columns=None):
+    """Decodes a range of rows of a column store folder.
+
+    Args:
+        store (str): path to the folder holding the column files.
+        meta (dict): the metadata of the store, see `write_cache()`.
+        start (int): the first row of the range.
+        stop (int): the row after the last one, the end if not given.
+        columns (list): the columns to decode, all of them if not given.
+
+    Returns:
+        data (pd.DataFrame): the rows, backed by the store.
+    """
+
+    stop = meta["rows"] if stop is None else min(stop, meta["rows"])
+    start = min(start, stop)
+    tables = meta["tables"]
+    decoded = {}
+    station_dtype = None
+    for i, (column, kind) in enumerate(zip(meta["columns"], meta["kinds"])):
+        if columns is not None and column not in columns:
+            continue
+        dtype = np.dtype(meta["dtypes"][i])
+        if stop > start:
+            values = np.memmap(os.path.join(store, f"{i}.bin"),
+                               dtype=dtype, mode="r",
+                               offset=start * dtype.itemsize,
+                               shape=(stop - start,))
+        else:
+            values = np.zeros(0, dtype=dtype)
+
+        if kind == "timestamp":
+            decoded[column] = values.view("datetime64[ns]")
+        elif kind == "station":
+            if station_dtype is None:
+                station_dtype = pd.CategoricalDtype(tables["stations"])
+            decoded[column] = pd.Categorical.from_codes(values,
+                                                        dtype=station_dtype)
+        elif kind == "category":
+            decoded[column] = pd.Categorical.from_codes(values,
+                                                        tables[str(i)])
+        elif kind == "year":
+            decoded[column] = pd.arrays.IntegerArray(values, values == 0)
+        else:
+            decoded[column] = values
+    return pd.DataFrame(decoded, copy=False)
+
+
+@traced("load")
+def read_city_data(path):
+    """Reads a city dataset, parsing the CSV file only if not cached.
+
+    A store that is behind the file only gets the appended rows added,
+    otherwise it is built again from the whole file.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        city_data (pd.DataFrame): the dataset without its index column.
+    """
+
+    city_data = read_cache(path)
+    if city_data is not None:
+        return city_data
+
+    try:
+        with store_lock(path):
+            # Another session may have brought the store up to date
+            if read_cache(path) is None and append_to_cache(path) is None:
+                fingerprint = source_fingerprint(path)
+                write_cache(read_csv_file(path), path, fingerprint)
+            city_data = read_cache(path)
+    except OSError:
+        # A store that can't be written only costs the next run some time
+        pass
+
+    if city_data is None:
+        city_data = read_csv_file(path)
+    return city_data
+
+
+def append_csv(path, delta_path):
+    """Appends the rows of a delta file to a city file.
+
+    Args:
+        path (str): path to the city CSV file.
+        delta_path (str): path to a CSV file with the same columns.
+
+    Returns:
+        This function returns nothing.
+
+    Raises:
+        ValueError: if the files don't have the same columns.
+    """
+
+    with open(delta_path, "rb") as delta, open(path, "rb+") as city:
+        if delta.readline().strip() != city.readline().strip():
+            raise ValueError(f"{delta_path} doesn't have the columns of {path}")
+
+        city.seek(-1, os.SEEK_END)
+        if city.read(1) != b"\n":
+            city.write(b"\n")
+        shutil.copyfileobj(delta, city)
+
+
+def partitions_path(path):
+    """Locates the partitioned store of a city file.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        store (str): path to the folder holding one folder per year, each
+            holding one column store per month.
+    """
+
+    folder, file_name = os.path.split(path)
+    return os.path.join(folder, CACHE_FOLDER, PARTITIONS_FOLDER, file_name)
+
+
+def null_column(column, n_rows):
+    """Makes a column of missing values, of the type of a known column.
+
+    Args:
+        column (str): a column of STORE_SCHEMA but the timestamps & stations.
+        n_rows (int): the number of rows.
+
+    Returns:
+        values (pd.api.extensions.ExtensionArray or np.ndarray): the column.
+    """
+
+    dtype = CSV_DTYPES[column]
+    if dtype == "category":
+        return pd.Categorical.from_codes(np.full(n_rows, -1, dtype=np.int8),
+                                         categories=[])
+    if dtype == "Int16":
+        return pd.arrays.IntegerArray(np.zeros(n_rows, dtype=np.int16),
+                                      np.ones(n_rows, dtype=bool))
+    return np.full(n_rows, np.nan, dtype=dtype)
+
+
+@traced("write_partitions")
+def write_partitions(path):
+    """Splits a city file into column stores by start year & month.
+
+    Every partition has the columns of STORE_SCHEMA, with one set of code
+    tables per city so that partitions concatenate as they are. The
+    columns the file lacks are stored as missing values & listed in the
+    manifest, `meta.json` at the top of the store, along with the rows of
+    each partition. Files too big to be loaded are split chunk by chunk.
+    Stations are coded in sorted order, as in the column store, so that
+    ties between them break the same way.
+
+    The store's own lock must be held, see `open_partitions()`; it is not
+    the lock of the column store, which loading the file takes.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        manifest (dict): the manifest of the new store.
+    """
+
+    fingerprint = source_fingerprint(path)
+    store = partitions_path(path)
+    building = f"{store}.{os.getpid()}.tmp"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+
+    tables, rows, kinds, dtypes, missing = {}, collections.Counter(), [], [], []
+    if fingerprint[0] > STREAMING_SIZE:
+        chunks = read_csv_file(path, chunksize=CHUNK_ROWS)
+    else:
+        chunks = [read_city_data(path)]
+
+        # Seed the station table sorted, as `write_cache()` does
+        station_columns = [c for c in chunks[0].columns
+                           if COLUMN_KINDS.get(c) == "station"]
+        tables["stations"] = pd.Index(
+            pd.unique(chunks[0][station_columns].to_numpy().ravel())
+        ).dropna().sort_values().tolist()
+
+    for chunk in chunks:
+        missing = [c for c in STORE_SCHEMA if c not in chunk.columns]
+        chunk = chunk.assign(**{c: null_column(c, len(chunk)) for c in missing})
+        # Stations are written wide, as the table may still grow
+        columns = [(kind, values.astype(np.int32) if kind == "station"
+                    else values)
+                   for kind, values in encode_columns(chunk[STORE_SCHEMA],
+                                                      tables)]
+        kinds = [kind for kind, _ in columns]
+        dtypes = [values.dtype.str for _, values in columns]
+
+        # Group the rows by month, as months since year 0
+        start_time = chunk["Start Time"].dt
+        months = (start_time.year * 12 + start_time.month - 1).to_numpy()
+        order = np.argsort(months, kind="stable")
+        keys, firsts = np.unique(months[order], return_index=True)
+        for key, first, stop in zip(keys, firsts,
+                                    [*firsts[1:], len(order)]):
+            folder = os.path.join(building, *(f"{key // 12:04d}",
+                                              f"{key % 12 + 1:02d}"))
+            os.makedirs(folder, exist_ok=True)
+            for i, (_, values) in enumerate(columns):
+                with open(os.path.join(folder, f"{i}.bin"), "ab") as file:
+                    values[order[first:stop]].tofile(file)
+            rows[int(key)] += int(stop - first)
+
+    # Chunks add their new stations last, re-code them in sorted order &
+    # narrow them to the width `code_dtype()` gives the whole table
+    stations = pd.Index(tables.get("stations", []))
+    order = stations.argsort()
+    recode = np.full(len(stations) + 1, -1, dtype=np.int32)
+    recode[order] = np.arange(len(stations))
+    station_dtype = code_dtype(stations)
+    for key in rows:
+        folder = os.path.join(building, f"{key // 12:04d}",
+                              f"{key % 12 + 1:02d}")
+        for i, kind in enumerate(kinds):
+            if kind == "station":
+                column = os.path.join(folder, f"{i}.bin")
+                codes = np.fromfile(column, dtype=dtypes[i])
+                recode[codes].astype(station_dtype).tofile(column)
+    dtypes = [station_dtype.str if kind == "station" else dtype
+              for kind, dtype in zip(kinds, dtypes)]
+    tables["stations"] = stations[order].tolist()
+
+    # The code tables are complete once every chunk is encoded
+    for key, n_rows in rows.items():
+        write_meta(os.path.join(building, f"{key // 12:04d}",
+                                f"{key % 12 + 1:02d}"), {
+            "rows": n_rows,
+            "columns": STORE_SCHEMA,
+            "kinds": kinds,
+            "dtypes": dtypes,
+            "tables": tables,
+        })
+    manifest = {
+        "source": list(fingerprint),
+        "missing": missing,
+        "partitions": [[key // 12, key % 12 + 1, rows[key]]
+                       for key in sorted(rows)],
+    }
+    write_meta(building, manifest)
+
+    # Swap the stores, as `write_cache()` does
+    if os.path.exists(store):
+        os.replace(store, f"{building}.old")
+        shutil.rmtree(f"{building}.old", ignore_errors=True)
+    os.replace(building, store)
+    return manifest
+
+
+def open_partitions(path):
+    """Reads the manifest of the partitioned store of a city file.
+
+    The store is written first if it is missing or behind the file, under
+    its lock so that concurrent sessions don't both swap it in.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        manifest (dict): the manifest, see `write_partitions()`.
+    """
+
+    def read_manifest():
+        try:
+            with open(os.path.join(partitions_path(path), "meta.json")) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if manifest["source"] != list(source_fingerprint(path)):
+            return None
+        return manifest
+
+    manifest = read_manifest()
+    if manifest is None:
+        with store_lock(path, partitions_path(path)):
+            # Another session may have brought the store up to date
+            manifest = read_manifest() or write_partitions(path)
+    return manifest
+
+
+@traced("read_partitions")
+def read_partitions(path, months=(), dates=None, columns=None):
+    """Reads the partitions of a city that may hold trips of some months.
+
+    Partitions of other months, or outside the date range, are not
+    opened at all.
+
+    Args:
+        path (str): path to the city CSV file.
+        months (list): month numbers to keep, all months if empty.
+        dates (tuple): the date range to keep, see `parse_dates()`; all
+            days if None.
+        columns (list): columns of STORE_SCHEMA to read, those of the file
+            if not given; the others come as missing values.
+
+    Returns:
+        data (pd.DataFrame): the trips of the matching partitions, as
+            `read_city_data()` reads them.
+    """
+
+    manifest = open_partitions(path)
+    if columns is None:
+        columns = [c for c in STORE_SCHEMA if c not in manifest["missing"]]
+    first, stop = dates if dates is not None else (None, None)
+    first = None if first is None else first.astype("datetime64[M]")
+    stop = None if stop is None else (stop - 1).astype("datetime64[M]")
+
+    frames = []
+    for year, month, _ in manifest["partitions"]:
+        partition = np.datetime64(f"{year:04d}-{month:02d}", "M")
+        if months and month not in months or (
+            first is not None and partition < first
+            or stop is not None and partition > stop
+        ):
+            continue
+        frames.append(read_partition(path, year, month, columns))
+
+    # With no partition left, the columns still come with their types
+    if not frames:
+        year, month, _ = manifest["partitions"][0]
+        return read_partition(path, year, month, columns, stop=0)
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_partition(path, year, month, columns, stop=None):
+    """Decodes the partition of a city for one month.
+
+    Args:
+        path (str): path to the city CSV file.
+        year (int): the year of the partition.
+        month (int): the month number of the partition.
+        columns (list): the columns to decode.
+        stop (int): the number of rows to decode, all of them if not given.
+
+    Returns:
+        data (pd.DataFrame): the rows, backed by the store.
+    """
+
+    folder = os.path.join(partitions_path(path), f"{year:04d}",
+                          f"{month:02d}")
+    with open(os.path.join(folder, "meta.json")) as file:
+        return decode_store(folder, json.load(file), stop=stop,
+                            columns=columns)
+
+
+def ask_city():
+    """Asks the user for one of the three datasets.
+
+    Args:
+        This function takes no arguments.
+
+    Returns:
+        city (str): the chosen city, a key of CITIES.
+        None: if the user have chosen to quit.
+    """
+
+    # Print some user instructions
+    print("\nPlease, choose on of the following datasets:")
+    print("  1. Chicago,")
+    print("  2. New York,")
+    print("  3. Washington.")
+    print("NOTE: you can quit by pressing <enter>.")
+
+    while True:
+        # Get the user input
+        user_input = input("City: ").strip().title()
+
+        # Validate the user input
+        if not user_input:
+            print("\nThank you!")
+            return None
+        elif user_input in CITIES:
+            return user_input
+        else:
+            print("\nPlease, make sure to type the city name correctly!\n")
+
+
+def remember_city(city):
+    """Saves the chosen city, for the next session to load it first.
+
+    Args:
+        city (str): a key of CITIES.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    try:
+        os.makedirs(os.path.dirname(LAST_CITY_PATH), exist_ok=True)
+        with open(LAST_CITY_PATH, "w") as file:
+            file.write(city)
+    except OSError:
+        # Not knowing it only changes the order of the next prefetch
+        pass
+
+
+def prefetch_order():
+    """Orders the cities to load in the background.
+
+    Returns:
+        cities (list): the city chosen last time first, then the others.
+    """
+
+    try:
+        with open(LAST_CITY_PATH) as file:
+            last_city = file.read().strip()
+    except OSError:
+        last_city = None
+    return sorted(CITIES, key=lambda city: city != last_city)
+
+
+def prepare_city(path):
+    """Loads, processes & pre-aggregates a city file, quietly.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        raw_data (pd.DataFrame): the dataset as `read_city_data()` reads it.
+        cube (dict): the cube built by `build_cube()`.
+        time_index (dict): the index built by `build_time_index()`.
+        t_1 (int): when it was done, from `time.perf_counter_ns()`.
+    """
+
+    raw_data = read_city_data(path)
+    data = get_data_ready(raw_data.copy(deep=False), verbose=False)
+    return (raw_data, build_cube(data), build_time_index(data),
+            time.perf_counter_ns())
+
+
+def start_prefetch(workers=2):
+    """Starts loading every city in background threads, see `load_city()`.
+
+    The city chosen last time is loaded first, so it is most likely ready
+    by the time the user picks it, while the user is answering prompts.
+    The cities whose file is missing are skipped.
+
+    Args:
+        workers (int): the number of threads.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    global PREFETCH_POOL
+    PREFETCH_POOL = concurrent.futures.ThreadPoolExecutor(
+        workers, thread_name_prefix="prefetch"
+    )
+    for city in prefetch_order():
+        path = CITIES[city]
+        if not os.path.exists(path):
+            continue
+        PREFETCH[path] = (source_fingerprint(path),
+                          PREFETCH_POOL.submit(prepare_city, path))
+
+
+def stop_prefetch():
+    """Drops the background loads that haven't started yet.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    if PREFETCH_POOL is not None:
+        PREFETCH_POOL.shutdown(wait=False, cancel_futures=True)
+
+
+def prefetched(path):
+    """Finds the background load of a city file, if still up to date.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        loading (concurrent.futures.Future): the load, see `prepare_city()`.
+        None: if the file wasn't loaded, or has changed since.
+    """
+
+    fingerprint, loading = PREFETCH.get(path, (None, None))
+    if loading is None or loading.cancelled():
+        return None
+    if fingerprint != source_fingerprint(path):
+        return None
+    return loading
+
+
+def load_city(path):
+    """Loads a city file in the background, unless it already is.
+
+    A load that is still waiting its turn in the prefetch queue is rather
+    started right away in its own thread.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        loading (concurrent.futures.Future): the load, see `prepare_city()`.
+    """
+
+    loading = prefetched(path)
+    if loading is not None and not loading.cancel():
+        return loading
+
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    loading = executor.submit(prepare_city, path)
+    executor.shutdown(wait=False)
+    PREFETCH[path] = (source_fingerprint(path), loading)
+    return loading
+
+
+def intern_stations(data):
+    """Makes both station columns share one categorical dictionary.
+
+    Args:
+        data (pd.DataFrame): data with `start_station` & `end_station`.
+
+    Returns:
+        stations (pd.Index): the station names, indexed by station code.
+    """
+
+    start, end = data["start_station"], data["end_station"]
+    if isinstance(start.dtype, pd.CategoricalDtype) and start.dtype == end.dtype:
+        return start.cat.categories
+
+    names = [
+        s.cat.categories if isinstance(s.dtype, pd.CategoricalDtype)
+        else pd.Index(s.dropna().unique())
+        for s in (start, end)
+    ]
+    stations = pd.CategoricalDtype(names[0].union(names[1]))
+    data["start_station"] = start.astype(stations)
+    data["end_station"] = end.astype(stations)
+    return stations.categories
+
+
+def pack_trips(start_station, end_station):
+    """Encodes each trip as one integer made of its two station codes.
+
+    Args:
+        start_station (pd.Series): start stations, sharing their
+            dictionary with `end_station`.
+        end_station (pd.Series): end stations.
+
+    Returns:
+        trips (np.ndarray): int64 trip codes, -1 where a station is missing.
+    """
+
+    n_stations = len(start_station.cat.categories)
+    start = start_station.cat.codes.to_numpy(dtype=np.int64)
+    end = end_station.cat.codes.to_numpy(dtype=np.int64)
+    return np.where((start >= 0) & (end >= 0), start * n_stations + end, -1)
+
+
+def trip_seconds(start_time, end_time):
+    """Computes trip durations from their timestamps, in whole seconds.
+
+    Args:
+        start_time (pd.Series): the start timestamps.
+        end_time (pd.Series): the end timestamps.
+
+    Returns:
+        seconds (np.ndarray): the int64 duration of each trip.
+    """
+
+    return (end_time.to_numpy() - start_time.to_numpy()) // np.timedelta64(
+        1, "s"
+    )
+
+
+def od_matrix(trips, stations):
+    """Lays trip counts out as a sparse origin-destination matrix.
+
+    The matrix is kept in compressed sparse row form: the trips leaving
+    start station `i` end at the stations coded `indices[indptr[i]:
+    indptr[i + 1]]`, counted by the same slice of `data`. Trip codes are
+    sorted start station first, so the counts are laid out as they are.
+
+    Args:
+        trips (pd.Series): trip counts indexed by the sorted codes made by
+            `pack_trips()`, as in the summaries; those of `query_cube()`
+            give the matrix of some months & weekdays.
+        stations (pd.Index): the station names, indexed by station code.
+
+    Returns:
+        matrix (dict): the `indptr`, `indices` & `data` arrays, with the
+            station names.
+    """
+
+    codes = trips.index.to_numpy(dtype=np.int64)
+    keep = codes >= 0
+    start, end = np.divmod(codes[keep], len(stations))
+    return {
+        "indptr": np.searchsorted(start, np.arange(len(stations) + 1)),
+        "indices": end.astype(np.int32),
+        "data": trips.to_numpy(dtype=np.int64)[keep],
+        "stations": stations,
+    }
+
+
+def top_routes(matrix, n=TOP_TRIPS):
+    """Finds the most common trips of an origin-destination matrix.
+
+    Args:
+        matrix (dict): a matrix made by `od_matrix()`.
+        n (int): the number of trips.
+
+    Returns:
+        routes (list): the start & end station names & count of each trip,
+            most common first, ties in station code order.
+    """
+
+    top = np.argsort(-matrix["data"], kind="stable")[:n]
+    starts = np.searchsorted(matrix["indptr"], top, side="right") - 1
+    stations = matrix["stations"]
+    return [(stations[start], stations[matrix["indices"][i]],
+             int(matrix["data"][i]))
+            for start, i in zip(starts, top)]
+
+
+def station_flows(matrix):
+    """Counts the trips leaving & reaching each station of a matrix.
+
+    Args:
+        matrix (dict): a matrix made by `od_matrix()`.
+
+    Returns:
+        flows (pd.DataFrame): the `outbound` & `inbound` trips of each
+            station and their `net` difference, the bikes it gains.
+    """
+
+    n_stations = len(matrix["stations"])
+    starts = np.repeat(np.arange(n_stations), np.diff(matrix["indptr"]))
+    outbound = np.bincount(starts, weights=matrix["data"],
+                           minlength=n_stations).astype(np.int64)
+    inbound = np.bincount(matrix["indices"], weights=matrix["data"],
+                          minlength=n_stations).astype(np.int64)
+    return pd.DataFrame({"outbound": outbound, "inbound": inbound,
+                         "net": inbound - outbound},
+                        index=matrix["stations"])
+
+
+@traced("preprocess")
+def get_data_ready(raw_data, verbose=True):
+    """Set the correct data types & create new columns as needed.
+
+    Only the trips missing a start or end time are dropped. Stations &
+    demographics are kept as nullable codes, user types & genders as
+    categories (int8 codes, -1 where missing) & birth years as nullable
+    int16, and each statistic leaves out the trips missing its columns.
+
+    Args:
+        raw_data (pd.DataFrame): data before processing.
+        verbose (bool): whether to report the progress.
+
+    Returns:
+        data (pd.DataFrame): data after processing.
+    """
+
+    if verbose:
+        print("\nProcessing data..")
+
+    # Drop the trips that can't be timed, copying only if there are any
+    timed = raw_data["Start Time"].notna() & raw_data["End Time"].notna()
+    if not timed.all():
+        raw_data = raw_data[timed]
+
+    # Rename columns
+    raw_data.rename(columns=lambda x: x.replace(" ", "_").lower(),
+                    inplace=True)
+
+    # Keep demographics as compact nullable codes
+    for column in ("user_type", "gender"):
+        if column in raw_data.columns:
+            raw_data[column] = raw_data[column].astype("category")
+    if "birth_year" in raw_data.columns:
+        raw_data["birth_year"] = raw_data["birth_year"].astype("Int16")
+
+    # Create new columns as needed
+    # NOTE: calendar fields are small integers, named only when printed
+    raw_data["month"] = raw_data["start_time"].dt.month.astype(np.int8)
+    raw_data["day"] = raw_data["start_time"].dt.dayofweek.astype(np.int8)
+    raw_data["start_hour"] = raw_data["start_time"].dt.hour.astype(np.int8)
+    raw_data["trip_duration"] = trip_seconds(raw_data["start_time"],
+                                             raw_data["end_time"])
+    intern_stations(raw_data)
+    raw_data["start_end_code"] = pack_trips(raw_data["start_station"],
+                                            raw_data["end_station"])
+
+    # Return data after processing
+    processed_data = raw_data
+    if verbose:
+        print("Done!")
+    return processed_data
+
+
+def open_cursor(path):
+    """Opens a cursor over the raw rows of a city file.
+
+    Nothing is parsed until a page is read, see `read_page()`.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        cursor (dict): the file, its header line, the next row to show &
+            where the rows seen so far start.
+    """
+
+    with open(path, "rb") as file:
+        header = file.readline()
+    return {"path": path, "header": header, "row": 0,
+            "anchors": [len(header)]}
+
+
+def seek_row(cursor, row):
+    """Finds where a row of a city file starts, without parsing any row.
+
+    Line ends are counted block by block from the closest row whose start
+    is known, & the start of every ANCHOR_ROWS-th row met on the way is
+    remembered, so jumping back & forth only scans a file once.
+
+    Args:
+        cursor (dict): a cursor made by `open_cursor()`.
+        row (int): the row, 0 being the first one after the header.
+
+    Returns:
+        offset (int): the position of the row in the file.
+        None: if the file has fewer rows.
+    """
+
+    anchors = cursor["anchors"]
+    known = min(row // ANCHOR_ROWS, len(anchors) - 1)
+    current, offset = known * ANCHOR_ROWS, anchors[known]
+    with open(cursor["path"], "rb") as file:
+        file.seek(offset)
+        while current < row:
+            block = file.read(SCAN_BYTES)
+            if not block:
+                return None
+
+            # The rows starting right after each line end of the block
+            ends = np.flatnonzero(np.frombuffer(block, dtype=np.uint8)
+                                  == ord("\n"))
+            starts = offset + ends + 1
+            rows = current + np.arange(1, len(ends) + 1)
+            new = (rows % ANCHOR_ROWS == 0) & (rows // ANCHOR_ROWS
+                                               >= len(anchors))
+            anchors.extend(starts[new].tolist())
+
+            if current + len(ends) >= row:
+                return int(starts[row - current - 1])
+            current += len(ends)
+            offset += len(block)
+    return offset
+
+
+def read_page(cursor, start, rows):
+    """Decodes a page of the raw rows of a city file.
+
+    The page is sliced from the column store if it is up to date, else
+    only its own lines of the CSV file are parsed.
+
+    Args:
+        cursor (dict): a cursor made by `open_cursor()`.
+        start (int): the first row of the page.
+        rows (int): the number of rows of the page.
+
+    Returns:
+        page (pd.DataFrame): the rows, indexed by their row number; fewer
+            or none past the end of the file.
+    """
+
+    path = cursor["path"]
+    meta = read_meta(path)
+    if meta is not None and meta["source"] == list(source_fingerprint(path)):
+        page = read_store_rows(path, meta, start, start + rows)
+    else:
+        offset = seek_row(cursor, start)
+        lines = []
+        if offset is not None:
+            with open(path, "rb") as file:
+                file.seek(offset)
+                lines = list(itertools.islice(file, rows))
+        page = read_csv_file(io.BytesIO(cursor["header"] + b"".join(lines)))
+    page.index = pd.RangeIndex(start, start + len(page))
+    return page
+
+
+def explore_data(cursor):
+    """Views pages of the raw data according to the user's request.
+
+    Args:
+        cursor (dict): a cursor over the dataset, see `open_cursor()`.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    # Print some user instructions
+    print("\nYou can explore data by viewing a defined number of rows.")
+    print("NOTE: you can jump to a row by typing it after the number of rows,")
+    print("      and quit by pressing <enter>.")
+
+    while True:
+        # Get the user input
+        answer = input("\nNumber of rows: ").strip().split()
+
+        # Validate the user input
+        if not answer:
+            print("\nThank you!")
+            break
+        if len(answer) <= 2 and all(word.isnumeric() for word in answer):
+            if len(answer) == 2:
+                cursor["row"] = int(answer[1])
+            page = read_page(cursor, cursor["row"], int(answer[0]))
+            if page.empty:
+                print("\nThere are no rows there!")
+                continue
+            print("\n")
+            print(page)
+            cursor["row"] += len(page)
+        else:
+            print("\nPlease, make sure to type number correctly!\n")
+
+
+@traced("build_filter_index")
+def build_filter_index(data, month="month", day="day"):
+    """Precomputes a row bitmap for every month & every weekday.
+
+    Args:
+        data (pd.DataFrame): the processed dataset.
+        month (str): name of the month column (1 - 12).
+        day (str): name of the weekday column (0 - 6).
+
+    Returns:
+        index (dict): packed bitmaps by dimension & code, the number of rows
+            & a cache for the selections answered so far.
+    """
+
+    months = data[month].to_numpy()
+    days = data[day].to_numpy()
+    return {
+        "month": {m: np.packbits(months == m) for m in range(1, 13)},
+        "day": {d: np.packbits(days == d) for d in range(7)},
+        "rows": len(data),
+        "selections": {},
+    }
+
+
+@traced("filter")
+def select_rows(index, months=(), days=()):
+    """Selects the rows matching a filter from the bitmap index.
+
+    Bitmaps are OR-ed within a dimension & AND-ed across dimensions, so
+    "Monday June" selects the Mondays of June.
+
+    Args:
+        index (dict): the index built by `build_filter_index()`.
+        months (list): month numbers to keep, all months if empty.
+        days (list): weekday numbers to keep, all days if empty.
+
+    Returns:
+        mask (np.ndarray): a boolean mask of the selected rows.
+        None: if the filter is empty.
+    """
+
+    key = (frozenset(months), frozenset(days))
+    if key not in index["selections"]:
+        bitmap = None
+        for dimension, codes in (("month", key[0]), ("day", key[1])):
+            if codes:
+                union = functools.reduce(
+                    np.bitwise_or, (index[dimension][c] for c in codes)
+                )
+                bitmap = union if bitmap is None else bitmap & union
+        index["selections"][key] = bitmap
+
+    bitmap = index["selections"][key]
+    if bitmap is None:
+        return None
+    return np.unpackbits(bitmap, count=index["rows"]).view(bool)
+
+
+@traced("build_time_index")
+def build_time_index(data):
+    """Sorts a processed dataset by start time, for range queries.
+
+    Args:
+        data (pd.DataFrame): the processed dataset.
+
+    Returns:
+        index (dict): the trips sorted by start time & their start times
+            as int64 nanoseconds, see `select_ranges()`.
+    """
+
+    if not data["start_time"].is_monotonic_increasing:
+        data = data.sort_values("start_time", kind="stable")
+    times = data["start_time"].to_numpy().astype("datetime64[ns]")
+    return {"data": data, "times": times.view(np.int64)}
+
+
+def hour_spans(hours):
+    """Splits an hour window into spans that don't cross midnight.
+
+    Args:
+        hours (tuple): the first hour & the hour the window stops at, see
+            `parse_hours()`; the whole day if None.
+
+    Returns:
+        spans (np.ndarray): the [first, stop) hours of each span.
+    """
+
+    if hours is None:
+        return np.array([[0, 24]])
+    first, stop = hours
+    if first < stop:
+        return np.array([[first, stop]])
+    return np.array([[0, stop], [first, 24]])
+
+
+@traced("filter")
+def select_ranges(index, months=(), days=(), dates=None, hours=None):
+    """Finds the row ranges matching a filter by binary search.
+
+    A date range alone is one slice of the sorted trips; months, weekdays
+    & hour windows make one slice per matching calendar day (two if the
+    window crosses midnight), so a query costs a binary search per day
+    rather than a pass over the trips.
+
+    Args:
+        index (dict): the index built by `build_time_index()`.
+        months (list): month numbers to keep, all months if empty.
+        days (list): weekday numbers to keep, all days if empty.
+        dates (tuple): the first day & the day the range stops at, see
+            `parse_dates()`; all days if None.
+        hours (tuple): the hour window to keep, see `parse_hours()`; all
+            hours if None.
+
+    Returns:
+        ranges (np.ndarray): the [start, stop) rows of each range, in
+            order, touching ranges merged.
+    """
+
+    times = index["times"]
+    if not len(times):
+        return np.empty((0, 2), dtype=np.intp)
+    lower, upper = times[0], times[-1] + 1
+    if dates is not None:
+        start, stop = (None if day is None
+                       else np.datetime64(day, "ns").astype(np.int64)
+                       for day in dates)
+        lower = lower if start is None else max(lower, start)
+        upper = upper if stop is None else min(upper, stop)
+        if lower >= upper:
+            return np.empty((0, 2), dtype=np.intp)
+
+    if months or days or hours is not None:
+        # One window per calendar day, leaving out other months & weekdays
+        day_ns, hour_ns = 86400 * 10**9, 3600 * 10**9
+        calendar = np.arange(lower // day_ns, (upper - 1) // day_ns + 1)
+        if months:
+            month = calendar.astype("datetime64[D]").astype("datetime64[M]")
+            calendar = calendar[np.isin(month.astype(np.int64) % 12 + 1,
+                                        months)]
+        if days:
+            # 1970-01-01 was a Thursday
+            calendar = calendar[np.isin((calendar + 3) % 7, days)]
+        spans = hour_spans(hours) * hour_ns
+        starts = (calendar[:, None] * day_ns + spans[:, 0]).ravel()
+        stops = (calendar[:, None] * day_ns + spans[:, 1]).ravel()
+    else:
+        starts, stops = np.array([lower]), np.array([upper])
+
+    starts = np.searchsorted(times, np.clip(starts, lower, upper))
+    stops = np.searchsorted(times, np.clip(stops, lower, upper))
+
+    # Drop the empty ranges & merge those that touch
+    kept = stops > starts
+    starts, stops = starts[kept], stops[kept]
+    if not len(starts):
+        return np.empty((0, 2), dtype=np.intp)
+    apart = starts[1:] > stops[:-1]
+    return np.column_stack([starts[np.r_[True, apart]],
+                            stops[np.r_[apart, True]]])
+
+
+def slice_ranges(index, ranges):
+    """Gathers the trips of row ranges of the time index.
+
+    Args:
+        index (dict): the index built by `build_time_index()`.
+        ranges (np.ndarray): ranges found by `select_ranges()`.
+
+    Returns:
+        data (pd.DataFrame): the trips of the ranges, a view if there is
+            only one.
+    """
+
+    data = index["data"]
+    if len(ranges) == 1:
+        return data.iloc[ranges[0, 0]:ranges[0, 1]]
+    lengths = ranges[:, 1] - ranges[:, 0]
+    offsets = np.repeat(ranges[:, 0] - np.cumsum(lengths) + lengths, lengths)
+    return data.iloc[offsets + np.arange(lengths.sum())]
+
+
+def parse_dates(text):
+    """Reads a date range, as in "2017-03-01..2017-03-15".
+
+    Either end may be left out, and a single date is a range of one day.
+
+    Args:
+        text (str): the range, both of its ends included.
+
+    Returns:
+        dates (tuple): the first day & the day after the last one, as
+            np.datetime64 days, None for an open end.
+
+    Raises:
+        ValueError: if the text is not a date range.
+    """
+
+    first, dots, last = text.partition("..")
+    if not dots:
+        last = first
+    ends = [np.datetime64(end) if end else None for end in (first, last)]
+    if ends == [None, None] or any(
+        end is not None and end.dtype != np.dtype("datetime64[D]")
+        for end in ends
+    ):
+        raise ValueError(f"not a date range: {text!r}")
+    return ends[0], None if ends[1] is None else ends[1] + 1
+
+
+def parse_hours(text):
+    """Reads an hour window, as in "7-10" for the trips starting from 7:00
+    to 9:59, or "22-2" for those starting from 22:00 to 1:59.
+
+    Args:
+        text (str): the first hour & the hour the window stops at.
+
+    Returns:
+        hours (tuple): the two hours, as integers.
+
+    Raises:
+        ValueError: if the text is not an hour window.
+    """
+
+    first, dash, stop = text.partition("-")
+    hours = (int(first), int(stop)) if dash else ()
+    if not hours or not (0 <= hours[0] <= 23 and 0 <= hours[1] <= 24):
+        raise ValueError(f"not an hour window: {text!r}")
+    return hours
+
+
+def ask_filters():
+    """Asks the user for the days, months, dates & hours to analyze.
+
+    Args:
+        This function takes no arguments.
+
+    Returns:
+        months (list): the chosen month numbers, empty for all months.
+        days (list): the chosen weekday numbers, empty for all days.
+        dates (tuple): the chosen date range, None for all dates.
+        hours (tuple): the chosen hour window, None for all hours.
+    """
+
+    # Print some user instructions
+    print("\nYou can filter the data by day, month, date or hour,")
+    print("  1. Weekday: Monday - Sunday.")
+    print("  2. Month: January - December.")
+    print("  3. Dates: 2017-03-01, or a range as 2017-03-01..2017-03-15.")
+    print("  4. Hours: 7-10 for trips starting from 7 to 10 AM, 22-2 at night.")
+    print("NOTE: you can enter any number of words separated by a space.")
+    print("NOTE: filters combine, e.g. 'Monday June 7-10' for June Monday "
+          "mornings.")
+    print("NOTE: you can quit by pressing enter.")
+
+    while True:
+        # Get the user filters
+        user_filters = input("\nFilter by: ").strip().title().split(" ")
+        filter_by = [f for f in user_filters if f in (*DAYS, *MONTHS)]
+
+        # Read the date ranges & hour windows, the last one of each counts
+        dates = hours = None
+        for f in user_filters:
+            for parse in (parse_hours, parse_dates):
+                try:
+                    parsed = parse(f)
+                except ValueError:
+                    continue
+                if parse is parse_hours:
+                    hours = parsed
+                else:
+                    dates = parsed
+                filter_by.append(f)
+                break
+
+        # Validate the user input
+        if len(user_filters) == 1 and not user_filters[0]:
+            print("\nProceeding with data analysis without filtration..")
+            return [], [], None, None
+        elif len(filter_by) == len(user_filters):
+            months = [MONTHS.index(f) + 1 for f in filter_by if f in MONTHS]
+            days = [DAYS.index(f) for f in filter_by if f in DAYS]
+            return months, days, dates, hours
+        else:
+            print("\nIt appears that you have one or typo(s)!")
+            print("Please, make sure to type day/month name, date or hours "
+                  "correctly!\n")
+
+
+def filter_data(data, index=None):
+    """Filters the data according to the user's request.
+
+    Args:
+        data (pd.DataFrame): data before being filtered.
+        index (dict): the data's filter index, built if not given.
+
+    Returns:
+        data (pd.DataFrame): data after being filtered.
+    """
+
+    if index is None:
+        index = build_filter_index(data)
+
+    months, days, dates, hours = ask_filters()
+    mask = select_rows(index, months, days)
+    if mask is None and dates is None and hours is None:
+        return data
+
+    print("\nFiltering data..")
+    filtered_data = data if mask is None else data[mask]
+    filtered_data = match_rows(filtered_data, dates=dates, hours=hours)
+    print("Done!")
+    return filtered_data
+
+
+@traced("filter")
+def match_rows(data, months=(), days=(), dates=None, hours=None):
+    """Filters processed trips by scanning their calendar columns.
+
+    Meant for data that is filtered only once, such as a chunk of a file,
+    where building a bitmap or time index would not pay off.
+
+    Args:
+        data (pd.DataFrame): the processed trips.
+        months (list): month numbers to keep, all months if empty.
+        days (list): weekday numbers to keep, all days if empty.
+        dates (tuple): the date range to keep, see `parse_dates()`; all
+            days if None.
+        hours (tuple): the hour window to keep, see `parse_hours()`; all
+            hours if None.
+
+    Returns:
+        data (pd.DataFrame): the matching trips.
+    """
+
+    if months:
+        data = data[data["month"].isin(months)]
+    if days:
+        data = data[data["day"].isin(days)]
+    if dates is not None:
+        start, stop = dates
+        if start is not None:
+            data = data[data["start_time"] >= start]
+        if stop is not None:
+            data = data[data["start_time"] < stop]
+    if hours is not None:
+        hour = data["start_hour"].to_numpy()
+        spans = hour_spans(hours)
+        data = data[((hour[:, None] >= spans[:, 0])
+                     & (hour[:, None] < spans[:, 1])).any(axis=1)]
+    return data
+
+
+def category_codes(series):
+    """Gets the integer codes of a text column & the names they stand for.
+
+    Missing values get the last code, named NaN, so that the rows lacking
+    a name still count as trips; `known()` leaves them out of the counts.
+
+    Args:
+        series (pd.Series): a categorical or plain text column.
+
+    Returns:
+        codes (np.ndarray): the code of each row.
+        names (pd.Index): the names, indexed by code, NaN last.
+    """
+
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, names = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, names = pd.factorize(series, sort=True)
+        names = pd.Index(names)
+    codes = np.where(codes < 0, len(names), codes)
+    return codes, names.append(pd.Index([np.nan]))
+
+
+def known(counts):
+    """Leaves the count of missing names out of counts by name.
+
+    Args:
+        counts (pd.Series): counts indexed by the names of
+            `category_codes()`.
+
+    Returns:
+        counts (pd.Series): the counts of the names that are known.
+    """
+
+    return counts[counts.index.notna()]
+
+
+def count_rows(*columns):
+    """Counts the rows of each distinct combination of integer columns.
+
+    The columns are packed into a single int64 key, which is much faster
+    to count than grouping by several columns, & keys spanning no more
+    values than a few per row are counted with a plain bincount.
+
+    Args:
+        *columns (np.ndarray): integer columns of the same length.
+
+    Returns:
+        counts (pd.Series): the counts, indexed by the sorted combinations.
+    """
+
+    lows = [int(c.min()) if len(c) else 0 for c in columns]
+    spans = [int(c.max()) - low + 1 if len(c) else 1
+             for c, low in zip(columns, lows)]
+    key = np.zeros(len(columns[0]), dtype=np.int64)
+    for column, low, span in zip(columns, lows, spans):
+        key = key * span + (column.astype(np.int64) - low)
+    if math.prod(spans) <= 4 * len(key) + 2**16:
+        counts = np.bincount(key, minlength=math.prod(spans))
+        key = np.flatnonzero(counts)
+        counts = counts[key]
+    else:
+        counts = pd.Series(key).value_counts(sort=False).sort_index()
+        key, counts = counts.index.to_numpy(), counts.to_numpy()
+
+    # Unpack the keys, last column first
+    levels = []
+    for low, span in zip(lows[::-1], spans[::-1]):
+        key, level = np.divmod(key, span)
+        levels.insert(0, level + low)
+    return pd.Series(counts, index=pd.MultiIndex.from_arrays(levels))
+
+
+def label_user_types(counts, names):
+    """Names the user type codes that counts are first indexed by.
+
+    Args:
+        counts (pd.Series): counts indexed by user type code, then more.
+        names (pd.Index): the user type names, indexed by code.
+
+    Returns:
+        counts (pd.Series): the same counts, indexed by user type name.
+    """
+
+    index = counts.index
+    return counts.set_axis(
+        index.set_levels(names[index.levels[0]], level=0, verify_integrity=False)
+    )
+
+
+@traced("build_cube")
+def build_cube(data):
+    """Pre-aggregates a processed dataset by month & weekday.
+
+    Trip counts & travel times are kept per (month, weekday, hour, user
+    type, gender) cell, while stations, trips & birth years get their own
+    per (month, weekday) count tables. Month 0 is left empty, so months
+    index the cube by their own number.
+
+    Args:
+        data (pd.DataFrame): the processed dataset.
+
+    Returns:
+        cube (dict): the count & sum tables, with the names of their codes.
+    """
+
+    month = data["month"].to_numpy(dtype=np.intp)
+    day = data["day"].to_numpy(dtype=np.intp)
+    hour = data["start_hour"].to_numpy(dtype=np.intp)
+    cell = month * 7 + day
+    n_rows = len(data)
+
+    # The (month, weekday, hour, user type, gender) cube
+    user_types, user_type_names = category_codes(data["user_type"])
+    if "gender" in data.columns:
+        genders, gender_names = category_codes(data["gender"])
+    else:
+        genders, gender_names = np.zeros(n_rows, dtype=np.intp), None
+    n_genders = 1 if gender_names is None else len(gender_names)
+    shape = (13, 7, 24, len(user_type_names), n_genders)
+    flat = np.ravel_multi_index((month, day, hour, user_types, genders), shape)
+    cube = {
+        "trips": np.bincount(flat, minlength=np.prod(shape)).reshape(shape),
+        "travel_time": np.bincount(
+            flat, weights=data["trip_duration"], minlength=np.prod(shape)
+        ).reshape(shape),
+        "user_types": user_type_names,
+        "genders": gender_names,
+    }
+
+    # The station tables, sharing one dictionary; missing stations, coded
+    # -1, are counted in a first slot that is then left out
+    stations = data["start_station"].cat.categories
+    n_slots = len(stations) + 1
+    for column in ("start_station", "end_station"):
+        codes = cell * n_slots + data[column].cat.codes.to_numpy() + 1
+        cube[column] = np.bincount(
+            codes, minlength=13 * 7 * n_slots
+        ).reshape(13, 7, n_slots)[:, :, 1:]
+    cube["stations"] = stations
+
+    # The trip table, only holding the trips that occur between known
+    # stations
+    trips = pd.Series(np.ones(n_rows, dtype=np.int64)).groupby(
+        [month, day, data["start_end_code"].to_numpy()]
+    ).sum().drop(-1, level=2, errors="ignore")
+    cube["trip_month"] = trips.index.get_level_values(0).to_numpy()
+    cube["trip_day"] = trips.index.get_level_values(1).to_numpy()
+    cube["trip_code"] = trips.index.get_level_values(2).to_numpy()
+    cube["trip_count"] = trips.to_numpy()
+
+    # The duration table, counting the trips of each length in seconds
+    cube["duration"] = count_rows(month, day, user_types,
+                                  data["trip_duration"].to_numpy())
+
+    # The birth year table, of the trips whose year is known
+    cube["birth_years"] = None
+    valid = (data["birth_year"].notna().to_numpy()
+             if "birth_year" in data.columns else np.zeros(0, dtype=bool))
+    if valid.any():
+        years = data["birth_year"].to_numpy(dtype=np.intp, na_value=0)[valid]
+        first_year = years.min()
+        n_years = years.max() - first_year + 1
+        cube["birth_year"] = np.bincount(
+            cell[valid] * n_years + years - first_year,
+            minlength=13 * 7 * n_years,
+        ).reshape(13, 7, n_years)
+        cube["birth_years"] = pd.RangeIndex(first_year, first_year + n_years)
+
+    return cube
+
+
+@traced("query_cube")
+def query_cube(cube, months=(), days=()):
+    """Aggregates the trips matching a filter from the cube.
+
+    Args:
+        cube (dict): the cube built by `build_cube()`.
+        months (list): month numbers to keep, all months if empty.
+        days (list): weekday numbers to keep, all days if empty.
+
+    Returns:
+        summary (dict): the trip count, the counts by month, weekday, hour,
+            user type, gender, station, trip, user type & duration and birth
+            year, and the total travel time of the matching trips.
+    """
+
+    # Mark the selected (month, weekday) cells
+    cells = np.zeros((13, 7), dtype=bool)
+    cells[np.ix_(list(months) or range(1, 13), list(days) or range(7))] = True
+    counts = cube["trips"] * cells[:, :, None, None, None]
+
+    summary = {
+        "trips": int(counts.sum()),
+        "month": counts.sum(axis=(1, 2, 3, 4)),
+        "day": counts.sum(axis=(0, 2, 3, 4)),
+        "hour": counts.sum(axis=(0, 1, 3, 4)),
+        "travel_time": int(
+            (cube["travel_time"] * cells[:, :, None, None, None]).sum()
+        ),
+        "user_type": pd.Series(counts.sum(axis=(0, 1, 2, 4)),
+                               index=cube["user_types"]),
+        "gender": None,
+        "stations": cube["stations"],
+        "start_station": cube["start_station"][cells].sum(axis=0),
+        "end_station": cube["end_station"][cells].sum(axis=0),
+        "trip_sketch": None,
+        "birth_year": None,
+    }
+    if cube["genders"] is not None:
+        summary["gender"] = pd.Series(counts.sum(axis=(0, 1, 2, 3)),
+                                      index=cube["genders"])
+    if cube["birth_years"] is not None:
+        summary["birth_year"] = pd.Series(cube["birth_year"][cells].sum(axis=0),
+                                          index=cube["birth_years"])
+
+    keep = cells[cube["trip_month"], cube["trip_day"]]
+    summary["trip"] = pd.Series(cube["trip_count"][keep]).groupby(
+        cube["trip_code"][keep]
+    ).sum()
+
+    durations = cube["duration"]
+    keep = cells[durations.index.get_level_values(0),
+                 durations.index.get_level_values(1)]
+    summary["duration"] = label_user_types(
+        durations[keep].groupby(level=[2, 3]).sum(), cube["user_types"]
+    )
+    return summary
+
+
+def align_axis(counts, names, union, axis):
+    """Lays counts out along the positions of a wider set of names.
+
+    Args:
+        counts (np.ndarray): counts indexed by `names` along `axis`.
+        names (pd.Index): the names `counts` is indexed by.
+        union (pd.Index): a superset of `names`.
+        axis (int): the axis indexed by the names.
+
+    Returns:
+        counts (np.ndarray): the counts indexed by `union`, 0 elsewhere.
+    """
+
+    shape = list(counts.shape)
+    shape[axis] = len(union)
+    aligned = np.zeros(shape, dtype=counts.dtype)
+    positions = [slice(None)] * counts.ndim
+    positions[axis] = union.get_indexer(names)
+    aligned[tuple(positions)] = counts
+    return aligned
+
+
+@traced("merge_cubes")
+def merge_cubes(first, second):
+    """Combines the cubes of two disjoint sets of trips.
+
+    This lets a cube take in newly appended trips without going over the
+    trips it already holds; only its tables are re-laid out.
+
+    Args:
+        first (dict): a cube built by `build_cube()`.
+        second (dict): another cube, e.g. of the appended trips.
+
+    Returns:
+        cube (dict): the cube of all the trips of both.
+    """
+
+    cube = {}
+
+    # The (month, weekday, hour, user type, gender) cube
+    user_types = first["user_types"].union(second["user_types"])
+    genders = None
+    if first["genders"] is not None or second["genders"] is not None:
+        genders = (first["genders"] if second["genders"] is None
+                   else second["genders"] if first["genders"] is None
+                   else first["genders"].union(second["genders"]))
+    for name in ("trips", "travel_time"):
+        total = 0
+        for part in (first, second):
+            table = align_axis(part[name], part["user_types"], user_types, 3)
+            if genders is not None and part["genders"] is not None:
+                table = align_axis(table, part["genders"], genders, 4)
+            total = total + table
+        cube[name] = total
+    cube["user_types"], cube["genders"] = user_types, genders
+
+    # The station tables & the trip table, re-coded into merged stations
+    stations = first["stations"].union(second["stations"])
+    trips = []
+    for part in (first, second):
+        for column in ("start_station", "end_station"):
+            table = align_axis(part[column], part["stations"], stations, 2)
+            cube[column] = cube.get(column, 0) + table
+        positions = stations.get_indexer(part["stations"])
+        start, end = np.divmod(part["trip_code"], len(part["stations"]))
+        trips.append(pd.DataFrame({
+            "month": part["trip_month"],
+            "day": part["trip_day"],
+            "code": positions[start].astype(np.int64) * len(stations)
+            + positions[end],
+            "count": part["trip_count"],
+        }))
+    trips = pd.concat(trips).groupby(["month", "day", "code"])["count"].sum()
+    cube["stations"] = stations
+    cube["trip_month"] = trips.index.get_level_values(0).to_numpy()
+    cube["trip_day"] = trips.index.get_level_values(1).to_numpy()
+    cube["trip_code"] = trips.index.get_level_values(2).to_numpy()
+    cube["trip_count"] = trips.to_numpy()
+
+    # The duration table, re-coded into merged user types
+    durations = []
+    for part in (first, second):
+        index = part["duration"].index
+        positions = user_types.get_indexer(part["user_types"])
+        durations.append(pd.Series(
+            part["duration"].to_numpy(),
+            index=pd.MultiIndex.from_arrays([
+                index.get_level_values(0), index.get_level_values(1),
+                positions[index.get_level_values(2)],
+                index.get_level_values(3),
+            ]),
+        ))
+    cube["duration"] = pd.concat(durations).groupby(level=[0, 1, 2, 3]).sum()
+
+    # The birth year table
+    parts = [p for p in (first, second) if p["birth_years"] is not None]
+    cube["birth_years"] = None
+    if parts:
+        birth_years = pd.RangeIndex(
+            min(p["birth_years"].start for p in parts),
+            max(p["birth_years"].stop for p in parts),
+        )
+        cube["birth_year"] = sum(
+            align_axis(p["birth_year"], p["birth_years"], birth_years, 2)
+            for p in parts
+        )
+        cube["birth_years"] = birth_years
+    return cube
+
+
+@traced("summarize")
+def summarize(data, approximate=False):
+    """Aggregates processed trips in a single pass over their columns.
+
+    Args:
+        data (pd.DataFrame): the processed (and maybe filtered) trips.
+        approximate (bool): whether to sketch the trips rather than count
+            every distinct one, see `sketch_trips()`.
+
+    Returns:
+        summary (dict): the same aggregates `query_cube()` returns, with
+            the trip sketch instead of the trip counts if approximate.
+    """
+
+    stations = data["start_station"].cat.categories
+    user_types, user_type_names = category_codes(data["user_type"])
+    summary = {
+        "trips": len(data),
+        "month": np.bincount(data["month"], minlength=13),
+        "day": np.bincount(data["day"], minlength=7),
+        "hour": np.bincount(data["start_hour"], minlength=24),
+        "travel_time": int(data["trip_duration"].sum()),
+        "user_type": pd.Series(
+            np.bincount(user_types, minlength=len(user_type_names)),
+            index=user_type_names,
+        ),
+        "gender": None,
+        "stations": stations,
+        "start_station": np.bincount(data["start_station"].cat.codes + 1,
+                                     minlength=len(stations) + 1)[1:],
+        "end_station": np.bincount(data["end_station"].cat.codes + 1,
+                                   minlength=len(stations) + 1)[1:],
+        "trip": None,
+        "trip_sketch": None,
+        "duration": label_user_types(
+            count_rows(user_types, data["trip_duration"].to_numpy()),
+            user_type_names,
+        ),
+        "birth_year": None,
+    }
+    if approximate:
+        summary["trip_sketch"] = sketch_trips(data)
+    else:
+        summary["trip"] = (data["start_end_code"].value_counts(sort=False)
+                           .sort_index().drop(-1, errors="ignore"))
+    if "gender" in data.columns:
+        genders, gender_names = category_codes(data["gender"])
+        summary["gender"] = pd.Series(
+            np.bincount(genders, minlength=len(gender_names)),
+            index=gender_names,
+        )
+    if "birth_year" in data.columns and data["birth_year"].notna().any():
+        years = data["birth_year"].dropna().to_numpy(dtype=np.intp)
+        first_year = years.min()
+        summary["birth_year"] = pd.Series(
+            np.bincount(years - first_year),
+            index=pd.RangeIndex(first_year, years.max() + 1),
+        )
+    return summary
+
+
+def duration_percentiles(counts):
+    """Selects the DURATION_PERCENTILES of some trip durations.
+
+    The durations are counted by whole second, so the k-th shortest trip is
+    found on the running counts without sorting any trip.
+
+    Args:
+        counts (pd.Series): trip counts indexed by sorted durations, in
+            seconds.
+
+    Returns:
+        percentiles (dict): the duration below which each percentage of
+            the trips fall, in minutes, by name, as in "p90".
+    """
+
+    running = np.cumsum(counts.to_numpy())
+    ranks = np.ceil(np.array(DURATION_PERCENTILES) / 100 * running[-1])
+    positions = np.searchsorted(running, np.maximum(ranks, 1))
+    return {f"p{percentile}": float(counts.index[position] / 60)
+            for percentile, position in zip(DURATION_PERCENTILES, positions)}
+
+
+def duration_histogram(counts):
+    """Counts trips by duration, in the bins bounded by DURATION_BINS.
+
+    Args:
+        counts (pd.Series): trip counts indexed by duration, in seconds.
+
+    Returns:
+        histogram (dict): the trip count of each bin, named as in "5-10"
+            minutes, the last one as in "120+".
+    """
+
+    bounds = np.array(DURATION_BINS) * 60
+    bins = np.searchsorted(bounds, counts.index.to_numpy(), side="right") - 1
+    totals = np.bincount(bins.clip(0), weights=counts.to_numpy(),
+                         minlength=len(bounds))
+    names = [f"{low}-{high}" for low, high in itertools.pairwise(DURATION_BINS)]
+    names.append(f"{DURATION_BINS[-1]}+")
+    return {name: int(total) for name, total in zip(names, totals)}
+
+
+@traced("describe")
+def describe(summary):
+    """Computes every reported statistic from the aggregates of some trips.
+
+    Args:
+        summary (dict): the aggregates of at least one trip.
+
+    Returns:
+        stats (dict): the statistics by name, ready to be printed; the
+            gender & birth year ones are None if the dataset lacks them,
+            the top trips & station imbalances if the trips are sketched,
+            and the station, trip & birth year ones if none of the trips
+            has them.
+    """
+
+    def most_common(counts):
+        return stations[counts.argmax()] if counts.any() else None
+
+    stations = summary["stations"]
+    stats = {
+        "trips": summary["trips"],
+        "most_common_month": MONTHS[summary["month"].argmax() - 1],
+        "most_common_day": DAYS[summary["day"].argmax()],
+        "most_common_hour": hour_name(summary["hour"].argmax()),
+        "most_common_start_station": most_common(summary["start_station"]),
+        "most_common_end_station": most_common(summary["end_station"]),
+        "most_common_trip": None,
+        "top_trips": None,
+        "most_net_arrivals": None,
+        "most_net_departures": None,
+        "total_travel_time": summary["travel_time"] / 60,
+        "mean_travel_time": summary["travel_time"] / 60 / summary["trips"],
+        "travel_time_percentiles": None,
+        "travel_time_histogram": None,
+        "travel_time_by_user_type": {},
+        "user_types": {
+            name: int(count)
+            for name, count in known(summary["user_type"]).items()
+        },
+        "genders": None,
+        "earliest_birth_year": None,
+        "most_recent_birth_year": None,
+        "most_common_birth_year": None,
+        "error_bounds": None,
+    }
+    # Only the trips between two known stations have a trip code
+    if summary["trip_sketch"] is None:
+        matrix = od_matrix(summary["trip"], stations)
+        if len(matrix["data"]):
+            stats["top_trips"] = top_routes(matrix)
+            stats["most_common_trip"] = stats["top_trips"][0][:2]
+            net = station_flows(matrix)["net"]
+            stats["most_net_arrivals"] = (net.idxmax(), int(net.max()))
+            stats["most_net_departures"] = (net.idxmin(), int(-net.min()))
+    elif len(summary["trip_sketch"]["key"]):
+        trip, count = top_sketched_trip(summary["trip_sketch"])
+        stats["most_common_trip"] = trip
+        stats["error_bounds"] = {"most_common_trip": {
+            "count": count,
+            "overcount": math.ceil(math.e / 2**SKETCH_BITS * summary["trips"]),
+            "confidence": 1 - math.exp(-SKETCH_DEPTH),
+        }}
+    durations = summary["duration"]
+    all_durations = durations.groupby(level=1).sum()
+    stats["travel_time_percentiles"] = duration_percentiles(all_durations)
+    stats["travel_time_histogram"] = duration_histogram(all_durations)
+    for name, counts in durations.groupby(level=0):
+        counts = counts.droplevel(0)
+        stats["travel_time_by_user_type"][name] = {
+            "trips": int(counts.sum()),
+            "mean_travel_time": float((counts.index * counts).sum() / 60
+                                      / counts.sum()),
+            **duration_percentiles(counts),
+        }
+    if summary["gender"] is not None:
+        stats["genders"] = {
+            name: int(count) for name, count in known(summary["gender"]).items()
+        }
+    birth_years = summary["birth_year"]
+    if birth_years is not None and (birth_years > 0).any():
+        birth_years = birth_years[birth_years > 0]
+        stats["earliest_birth_year"] = int(birth_years.index.min())
+        stats["most_recent_birth_year"] = int(birth_years.index.max())
+        stats["most_common_birth_year"] = int(birth_years.idxmax())
+    return stats
+
+
+def station_hashes(stations):
+    """Hashes the station names of each trip, whatever their codes.
+
+    Args:
+        stations (pd.Series): categorical station names.
+
+    Returns:
+        hashes (np.ndarray): a uint64 hash of each name.
+    """
+
+    names = np.asarray(stations.cat.categories, dtype=object)
+    return pd.util.hash_array(names)[stations.cat.codes.to_numpy()]
+
+
+def sketch_buckets(keys):
+    """Maps keys to one counter of each row of a Count-Min sketch.
+
+    Args:
+        keys (np.ndarray): uint64 keys.
+
+    Returns:
+        buckets (np.ndarray): the (SKETCH_DEPTH, len(keys)) counter indexes,
+            by multiply-shift hashing.
+    """
+
+    return (keys[None, :] * SKETCH_HASHES[:, None]) >> np.uint64(
+        64 - SKETCH_BITS
+    )
+
+
+@traced("sketch_trips")
+def sketch_trips(data):
+    """Sketches the trips of processed data, instead of counting them.
+
+    Every trip adds one to a counter in each row of a Count-Min sketch,
+    whose smallest counter never undercounts a trip. The candidates for the
+    most common trip are the trips of a bottom-k sample: the SAMPLE_SIZE
+    trips with the smallest hash, which any trip taking more than a few
+    thousandths of the trips is all but sure to be in. Both are keyed by
+    station names, so the sketches of any two sets of trips merge, see
+    `merge_trip_sketches()`.
+
+    Args:
+        data (pd.DataFrame): the processed trips.
+
+    Returns:
+        sketch (dict): the Count-Min table & the sampled trips.
+    """
+
+    # Only the trips between known stations are sketched
+    if (data["start_end_code"] < 0).any():
+        data = data[data["start_end_code"] >= 0]
+    start = station_hashes(data["start_station"])
+    end = station_hashes(data["end_station"])
+    keys = start ^ (end * np.uint64(0x9E3779B97F4A7C15))
+
+    table = np.zeros((SKETCH_DEPTH, 2**SKETCH_BITS), dtype=np.int64)
+    for row, buckets in enumerate(sketch_buckets(keys)):
+        table[row] = np.bincount(buckets.astype(np.intp),
+                                 minlength=2**SKETCH_BITS)
+
+    # The trips with the smallest hashes of their key & start time
+    times = data["start_time"].to_numpy().astype("datetime64[ns]")
+    priority = (keys ^ times.view(np.uint64)) * np.uint64(0xD6E8FEB86659FD93)
+    sample = np.arange(len(data))
+    if len(data) > SAMPLE_SIZE:
+        sample = np.argpartition(priority, SAMPLE_SIZE)[:SAMPLE_SIZE]
+    return {
+        "table": table,
+        "priority": priority[sample],
+        "key": keys[sample],
+        "start": np.asarray(data["start_station"].iloc[sample], dtype=object),
+        "end": np.asarray(data["end_station"].iloc[sample], dtype=object),
+    }
+
+
+def merge_trip_sketches(first, second):
+    """Combines the trip sketches of two disjoint sets of trips.
+
+    Args:
+        first (dict): a sketch made by `sketch_trips()`.
+        second (dict): another one.
+
+    Returns:
+        sketch (dict): the sketch of all the trips of both.
+    """
+
+    sample = {name: np.concatenate([first[name], second[name]])
+              for name in ("priority", "key", "start", "end")}
+    if len(sample["priority"]) > SAMPLE_SIZE:
+        keep = np.argpartition(sample["priority"], SAMPLE_SIZE)[:SAMPLE_SIZE]
+        sample = {name: values[keep] for name, values in sample.items()}
+    return {"table": first["table"] + second["table"], **sample}
+
+
+def top_sketched_trip(sketch):
+    """Estimates the most common trip from a trip sketch.
+
+    Args:
+        sketch (dict): a sketch made by `sketch_trips()`.
+
+    Returns:
+        trip (tuple): the start & end station names of the trip.
+        count (int): its estimated count, never below the true one.
+    """
 
-MONTHS = [
-    "January",
-    "February",
-    "March",
-    "April",
-    "May",
-    "June",
-    "July",
-    "August",
-    "September",
-    "October",
-    "November",
-    "December",
-]
+    keys, first = np.unique(sketch["key"], return_index=True)
+    buckets = sketch_buckets(keys).astype(np.intp)
+    counts = sketch["table"][np.arange(SKETCH_DEPTH)[:, None], buckets]
+    counts = counts.min(axis=0)
+    best = first[counts.argmax()]
+    return (sketch["start"][best], sketch["end"][best]), int(counts.max())
 
 
-def load_data():
-    """Loads one of the three datasets.
+@traced("merge_summaries")
+def merge_summaries(first, second):
+    """Combines the aggregates of two disjoint sets of trips.
+
+    Both summaries may use their own station dictionary, the merged one
+    uses the sorted union of the two, as a single pass over all the trips
+    would have.
 
     Args:
-        This function takes no arguments.
+        first (dict): a summary made by `summarize()` or `query_cube()`.
+        second (dict): another summary of the same kind.
 
     Returns:
-        loaded_data (pd.DataFrame): The requested dataset.
-        None: if the user have chosen to quit.
+        summary (dict): the aggregates of all the trips of both.
     """
 
-    # Print some user instructions
-    print("\nPlease, choose on of the following datasets:")
-    print("  1. Chicago,")
-    print("  2. New York,")
-    print("  3. Washington.")
-    print("NOTE: you can quit by pressing <enter>.")
+    def add(a, b):
+        if a is None or b is None:
+            return b if a is None else a
+        return a.add(b, fill_value=0).astype(np.int64)
+
+    # Re-code stations & trips into the merged station dictionary
+    stations = first["stations"].union(second["stations"])
+    station_counts = {"start_station": np.zeros(len(stations), dtype=np.int64),
+                      "end_station": np.zeros(len(stations), dtype=np.int64)}
+    trips = []
+    for summary in (first, second):
+        positions = stations.get_indexer(summary["stations"])
+        for column, counts in station_counts.items():
+            counts[positions] += summary[column]
+        if summary["trip"] is None:
+            continue
+        start, end = np.divmod(summary["trip"].index.to_numpy(dtype=np.int64),
+                               len(summary["stations"]))
+        trips.append(pd.Series(
+            summary["trip"].to_numpy(),
+            index=positions[start].astype(np.int64) * len(stations)
+            + positions[end],
+        ))
+
+    # Trip sketches are keyed by station names, so they merge as they are
+    trip, trip_sketch = None, None
+    if trips:
+        trip = pd.concat(trips).groupby(level=0).sum()
+    else:
+        trip_sketch = merge_trip_sketches(first["trip_sketch"],
+                                          second["trip_sketch"])
+
+    return {
+        "trips": first["trips"] + second["trips"],
+        "month": first["month"] + second["month"],
+        "day": first["day"] + second["day"],
+        "hour": first["hour"] + second["hour"],
+        "travel_time": first["travel_time"] + second["travel_time"],
+        "user_type": add(first["user_type"], second["user_type"]),
+        "gender": add(first["gender"], second["gender"]),
+        "stations": stations,
+        **station_counts,
+        "trip": trip,
+        "trip_sketch": trip_sketch,
+        "duration": pd.concat([first["duration"], second["duration"]])
+        .groupby(level=[0, 1], dropna=False).sum(),
+        "birth_year": add(first["birth_year"], second["birth_year"]),
+    }
+
+
+@traced("stream")
+def stream_summary(path, months=(), days=(), chunk_rows=CHUNK_ROWS,
+                   sections=None, approximate=False, dates=None, hours=None):
+    """Aggregates a city file chunk by chunk, never loading it whole.
+
+    Every chunk is processed as `get_data_ready()` does, filtered, then
+    summarized & merged into the running aggregates, so the memory used is
+    bounded by the chunk size.
 
-    while True:
-        # Get the user input
-        user_input = input("City: ").strip().title()
+    Args:
+        path (str): path to the city CSV file.
+        months (list): month numbers to keep, all months if empty.
+        days (list): weekday numbers to keep, all days if empty.
+        chunk_rows (int): the number of rows read at a time.
+        sections (list): only read the columns these REPORT_SECTIONS need,
+            all of them if not given.
+        approximate (bool): whether to sketch the trips, see
+            `sketch_trips()`.
 
-        # Validate the user input
-        if not user_input:
-            print("\nThank you!")
-            return None
-        elif user_input in CITIES:
-            print("\nLoading data..")
-            loaded_data = pd.read_csv(
-                filepath_or_buffer=f"{CITIES[user_input]}",
-                parse_dates=["Start Time", "End Time"],
-            ).iloc[:, 1:]
-            print("Done!")
-            return loaded_data
+    Returns:
+        summary (dict): the aggregates of the matching trips.
+    """
+
+    summary = None
+    chunks = read_csv_file(path, sections=sections, chunksize=chunk_rows)
+    for chunk in chunks:
+        chunk = get_data_ready(chunk, verbose=False)
+        chunk_summary = summarize(
+            match_rows(chunk, months, days, dates, hours), approximate
+        )
+        if summary is None:
+            summary = chunk_summary
         else:
-            print("\nPlease, make sure to type the city name correctly!\n")
+            summary = merge_summaries(summary, chunk_summary)
+    return summary
 
 
-def get_data_ready(raw_data):
-    """Set the correct data types & create new columns as needed.
+@traced("summarize_rows")
+def summarize_rows(path, start, stop, months=(), days=(), sections=None,
+                   approximate=False, dates=None, hours=None):
+    """Aggregates one row partition of a city file.
+
+    The partition is sliced from the memory-mapped column store, so a
+    worker only touches the pages of its own rows.
 
     Args:
-        raw_data (pd.DataFrame): data before processing.
+        path (str): path to the city CSV file.
+        start (int): the first row of the partition.
+        stop (int): the row after the last one of the partition.
+        months (list): month numbers to keep, all months if empty.
+        days (list): weekday numbers to keep, all days if empty.
+        sections (list): only use the columns these REPORT_SECTIONS need,
+            all of them if not given.
+        approximate (bool): whether to sketch the trips, see
+            `sketch_trips()`.
 
     Returns:
-        data (pd.DataFrame): data after processing.
+        summary (dict): the aggregates of the matching trips.
     """
 
-    print("\nProcessing data..")
+    data = read_city_data(path)
+    data = data[csv_columns(data.columns, sections)].iloc[start:stop]
+    data = data.copy(deep=False)
+    data = get_data_ready(data, verbose=False)
+    return summarize(match_rows(data, months, days, dates, hours),
+                     approximate)
 
-    # Drop NaNs
-    raw_data.dropna(inplace=True)
 
-    # Rename columns
-    raw_data.rename(columns=lambda x: x.replace(" ", "_").lower(),
-                    inplace=True)
+@traced("parallel_summary")
+def parallel_summary(path, months=(), days=(), partitions=None,
+                     sections=None, approximate=False, dates=None,
+                     hours=None):
+    """Aggregates a city file over row partitions in parallel processes.
 
-    # Reset data type for birth_year
-    if "birth_year" in raw_data.columns:
-        raw_data["birth_year"] = raw_data["birth_year"].astype(int)
+    Counting holds the GIL, hence processes rather than threads; the
+    partial aggregates are combined with `merge_summaries()`.
 
-    # Create new columns as needed
-    raw_data["month"] = raw_data["start_time"].dt.strftime("%B")
-    raw_data["day"] = raw_data["start_time"].dt.strftime("%A")
-    raw_data["start_hour"] = raw_data["start_time"].dt.strftime("%I %p")
-    raw_data["travel_time"] = (
-        raw_data["end_time"] - raw_data["start_time"]
-    ).dt.total_seconds() // 60
-    raw_data["start_end_combination"] = (
-        raw_data["start_station"] + " | " + raw_data["end_station"]
-    )
+    Args:
+        path (str): path to the city CSV file.
+        months (list): month numbers to keep, all months if empty.
+        days (list): weekday numbers to keep, all days if empty.
+        partitions (int): the number of partitions & processes, one per
+            CPU core if not given.
+        sections (list): only use the columns these REPORT_SECTIONS need,
+            all of them if not given.
+        approximate (bool): whether to sketch the trips, see
+            `sketch_trips()`.
 
-    # Return data after processing
-    processed_data = raw_data
-    print("Done!")
-    return processed_data
+    Returns:
+        summary (dict): the aggregates of the matching trips.
+    """
+
+    # Reading the file once up front makes sure its column store exists
+    partitions = partitions or os.cpu_count()
+    bounds = np.linspace(0, len(read_city_data(path)), partitions + 1,
+                         dtype=np.int64)
 
+    with concurrent.futures.ProcessPoolExecutor(partitions) as executor:
+        partials = executor.map(
+            summarize_rows,
+            [path] * partitions, bounds[:-1], bounds[1:],
+            [months] * partitions, [days] * partitions,
+            [sections] * partitions, [approximate] * partitions,
+            [dates] * partitions, [hours] * partitions,
+        )
+        return functools.reduce(merge_summaries, partials)
 
-def explore_data(data):
-    """Views a segment of data according to the user's request.
+
+def hour_name(hour):
+    """Names an hour of the day on the 12-hour clock.
 
     Args:
-        data (pd.DataFrame): the dataset being explored.
+        hour (int): the hour of the day, 0 - 23.
 
     Returns:
-        This function returns nothing.
+        name (str): the hour as in "07 PM".
     """
 
-    # Print some user instructions
-    print("\nYou can explore data by viewing a defined number of rows.")
-    print("NOTE: you can quit by pressing <enter>.")
+    return f"{(hour % 12) or 12:02d} {'AM' if hour < 12 else 'PM'}"
 
-    i = 0
-    while True:
-        # Get the user input
-        rows = input("\nNumber of rows: ").strip()
 
-        # Validate the user input
-        if not rows:
-            print("\nThank you!")
-            break
-        if rows.isnumeric():
-            rows = int(rows)
-            print("\n")
-            print(data[i:i + rows])
-            i += rows
-        else:
-            print("\nPlease, make sure to type number correctly!\n")
+def peak_memory():
+    """Measures the peak resident memory of this process so far.
+
+    Returns:
+        peak (int): the peak resident set size in bytes.
+        None: where the platform can't tell.
+    """
 
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux counts kilobytes, macOS bytes
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
 
-def filter_data(data):
-    """Filters the data according to the user's request.
+
+def print_load_stats(t_0, t_1=None):
+    """Reports how long loading took & the memory it peaked at.
 
     Args:
-        data (pd.DataFrame): data before being filtered.
+        t_0 (int): when loading started, from `time.perf_counter_ns()`.
+        t_1 (int): when it ended, now if not given.
 
     Returns:
-        data (pd.DataFrame): data after being filtered.
+        This function returns nothing.
     """
 
-    # Print some user instructions
-    print("\nYou can filter the data either by day or month,")
-    print("  1. Weekday: Saturday - Friday.")
-    print("  2. Month: January - December.")
-    print("NOTE: you can enter any number of words separated by a space.")
-    print("NOTE: you can quit by pressing enter.")
-
-    while True:
-        # Get the user filters
-        user_filters = input("\nFilter by: ").strip().title().split(" ")
-        filter_by = [f for f in user_filters if f in (*DAYS, *MONTHS)]
-
-        # Validate the user input
-        if len(user_filters) == 1 and not user_filters[0]:
-            print("\nProceeding with data analysis without filtration..")
-            return data
-        elif len(filter_by) == len(user_filters):
-            print("\nFiltering data..")
-            mask = data.isin(filter_by).any(axis=1)
-            filtered_data = data[mask]
-            print("Done!")
-            return filtered_data
-        else:
-            print("\nIt appears that you have one or typo(s)!")
-            print("Please, make sure to type day/month name correctly!\n")
+    t_delta = ((t_1 or time.perf_counter_ns()) - t_0) / 1e9
+    peak = peak_memory()
+    memory = "" if peak is None else f", peak memory {peak / 1024**2:.1f} MiB"
+    print(f"Done! ({round(t_delta, 2)} seconds{memory})")
 
 
 def timer(fn):
     """Time the decorated function in an elegant way.
 
+    Each call is also a span of the current trace, named after `fn`.
+
     Args:
         fn (function): the function being decorated.
 
@@ -185,10 +2746,12 @@ def timer(fn):
     """
 
     # Define the wrapper inner function
+    @functools.wraps(fn)
     def wrapper_fn(*args, **kwargs):
-        t_0 = dt.datetime.now()
-        output = fn(*args, **kwargs)
-        t_delta = (dt.datetime.now() - t_0).total_seconds()
+        t_0 = time.perf_counter_ns()
+        with span(fn.__name__):
+            output = fn(*args, **kwargs)
+        t_delta = (time.perf_counter_ns() - t_0) / 1e9
         print(f"\nThis took about {round(t_delta, 2)} seconds!")
         print("*" * 20)
         return output
@@ -198,100 +2761,133 @@ def timer(fn):
 
 
 @timer
-def time_stats(data):
+def time_stats(stats):
     """Displays statistics on the most frequent times of travel.
 
     Args:
-        data (pd.DataFrame): the data used in calculation.
+        stats (dict): the statistics computed by `describe()`.
 
     Returns:
         This function returns nothing.
     """
 
-    # The most common month
-    most_common_month = data["month"].value_counts(ascending=False).index[0]
-    print(f"Most common travel month: {most_common_month},")
-
-    # The most common month
-    most_common_day = data["day"].value_counts(ascending=False).index[0]
-    print(f"Most common travel day: {most_common_day},")
-
-    # The most common month
-    most_common_hour = data["start_hour"].value_counts(ascending=False).index[0]
-    print(f"Most common travel hour: {most_common_hour}.")
+    print(f"Most common travel month: {stats['most_common_month']},")
+    print(f"Most common travel day: {stats['most_common_day']},")
+    print(f"Most common travel hour: {stats['most_common_hour']}.")
 
 
 @timer
-def station_stats(data):
+def station_stats(stats):
     """
     Displays statistics on the most popular stations and trip.
 
     Args:
-        data (pd.DataFrame): the data used in calculation.
+        stats (dict): the statistics computed by `describe()`.
 
     Returns:
         This function returns nothing.
     """
 
-    # The most common start station
-    most_common_start = data["start_station"].value_counts(ascending=False).index[0]
-    print(f"Most common start-end combination: {most_common_start}.")
-
-    # The most common end station
-    most_common_end = data["end_station"].value_counts(ascending=False).index[0]
-    print(f"Most common start-end combination: {most_common_end}.")
-
-    # The most common start-end combination
-    most_common_combination = (
-        data["start_end_combination"].value_counts(ascending=False).index[0]
-    )
-    print(f"Most common start-end combination: {most_common_combination}.")
+    if stats["most_common_start_station"] is None:
+        print("NOTE: these trips have no information about start stations.")
+    else:
+        print("Most common start station: "
+              f"{stats['most_common_start_station']}.")
+    if stats["most_common_end_station"] is None:
+        print("NOTE: these trips have no information about end stations.")
+    else:
+        print(f"Most common end station: {stats['most_common_end_station']}.")
+
+    if stats["most_common_trip"] is None:
+        print("NOTE: none of these trips has both of its stations.")
+        return
+    trip_start, trip_end = stats["most_common_trip"]
+    print(f"Most common start-end combination: {trip_start} | {trip_end}.")
+
+    # How far off the approximate trip count may be
+    bound = (stats["error_bounds"] or {}).get("most_common_trip")
+    if bound is not None:
+        print(f"  (approximately {bound['count']} trips, at most "
+              f"{bound['overcount']} too many, "
+              f"{bound['confidence']:.0%} sure)")
+
+    # The trip counts, which only exact summaries have
+    if stats["top_trips"] is not None:
+        print("Most common trips:")
+        for i, (start, end, count) in enumerate(stats["top_trips"], 1):
+            print(f"  {i}. {start} | {end}: {count} trips"
+                  f"{'.' if i == len(stats['top_trips']) else ','}")
+        station, net = stats["most_net_arrivals"]
+        print(f"Station gaining the most bikes: {station} (+{net}),")
+        station, net = stats["most_net_departures"]
+        print(f"Station losing the most bikes: {station} (-{net}).")
 
 
 @timer
-def trip_duration_stats(data):
+def trip_duration_stats(stats):
     """
     Displays statistics on the total and average trip duration.
 
     Args:
-        data (pd.DataFrame): the data used in calculation.
+        stats (dict): the statistics computed by `describe()`.
 
     Returns:
         This function returns nothing.
     """
 
     # The mean travel time
-    mean_travel_time = data["travel_time"].mean()
+    mean_travel_time = stats["mean_travel_time"]
     print(f"Mean travel time: {round(mean_travel_time, 2)} minutes.")
 
     # The total travel time
-    total_travel_time = data["travel_time"].sum()
+    total_travel_time = stats["total_travel_time"]
     print(f"Total travel time: {round(total_travel_time / 60, 2)} hours.")
 
+    # The travel time percentiles
+    percentiles = ", ".join(
+        f"{name} {round(minutes, 2)}"
+        for name, minutes in stats["travel_time_percentiles"].items()
+    )
+    print(f"Travel time percentiles: {percentiles} minutes.")
+
+    # The travel time histogram
+    print("Counts of travel times (minutes):")
+    histogram = stats["travel_time_histogram"]
+    for i, (name, count) in enumerate(histogram.items(), 1):
+        print(f"  {name}: {count}{'.' if i == len(histogram) else ','}")
+
+    # The travel times of each user type
+    print("Travel times by user type:")
+    for name, times in stats["travel_time_by_user_type"].items():
+        percentiles = ", ".join(f"{p} {round(times[p], 2)}"
+                                for p in stats["travel_time_percentiles"])
+        print(f"  {name}: {times['trips']} trips, mean "
+              f"{round(times['mean_travel_time'], 2)}, {percentiles} minutes.")
+
 
 @timer
-def user_stats(data):
+def user_stats(stats):
     """
     Displays statistics on bike-share users.
 
     Args:
-        data (pd.DataFrame): the data used in calculation.
+        stats (dict): the statistics computed by `describe()`.
 
     Returns:
         This function returns nothing.
     """
 
     # The counts of user type
-    subscribers = len(data.query("user_type == 'Subscriber'"))
-    customers = len(data.query("user_type == 'Customer'"))
+    subscribers = stats["user_types"].get("Subscriber", 0)
+    customers = stats["user_types"].get("Customer", 0)
     print("Counts of user types:")
     print(f"  1. Subscribers: {subscribers},")
     print(f"  2. Customers: {customers}.")
 
     # The counts of gender
-    if "gender" in data.columns:
-        males = len(data.query("gender == 'Male'"))
-        females = len(data.query("gender == 'Female'"))
+    if stats["genders"] is not None:
+        males = stats["genders"].get("Male", 0)
+        females = stats["genders"].get("Female", 0)
         print("\nCounts of user genders:")
         print(f"  1. Males: {males},")
         print(f"  2. Females: {females}.")
@@ -299,52 +2895,438 @@ def user_stats(data):
         print("\nNOTE: this dataset has no information about user genders.")
 
     # The earliest, most recent, and most common year of birth
-    if "birth_year" in data.columns:
-        earliest_birth_year = data["birth_year"].min()
-        print(f"\nEarliest birth year: {earliest_birth_year},")
-
-        most_recent_birth_year = data["birth_year"].max()
-        print(f"Most recent birth year: {most_recent_birth_year},")
-
-        most_common_birth_year = data["birth_year"].mode()[0]
-        print(f"Most common birth year: {most_common_birth_year}.")
+    if stats["earliest_birth_year"] is not None:
+        print(f"\nEarliest birth year: {stats['earliest_birth_year']},")
+        print(f"Most recent birth year: {stats['most_recent_birth_year']},")
+        print(f"Most common birth year: {stats['most_common_birth_year']}.")
     else:
         print("\nNOTE: this dataset has no information about user birth year.")
 
 
-def main():
-    """Executes the script."""
+def new_result_cache(max_entries=256, max_bytes=64 * 1024**2, folder=None,
+                     max_disk_bytes=256 * 1024**2):
+    """Creates an empty LRU cache of computed statistics.
 
-    outer_loop = True
-    while outer_loop:
-        # Load the data
-        city_raw_data = load_data()
+    Args:
+        max_entries (int): the number of results kept in memory.
+        max_bytes (int): the total pickled size of the results kept in
+            memory.
+        folder (str): where to also persist results, in memory only if
+            not given.
+        max_disk_bytes (int): the total size of the result files kept in
+            the folder, the least recently used ones being removed.
 
-        # Give the user the option to quit
-        if city_raw_data is None:
+    Returns:
+        cache (dict): the entries, from least to most recently used, the
+            limits & the hit/miss counters.
+    """
+
+    return {
+        "entries": collections.OrderedDict(),
+        "bytes": 0,
+        "max_entries": max_entries,
+        "max_bytes": max_bytes,
+        "folder": folder,
+        "max_disk_bytes": max_disk_bytes,
+        "hits": 0,
+        "disk_hits": 0,
+        "misses": 0,
+    }
+
+
+def result_key(path, months=(), days=(), statistic="all", dates=None,
+               hours=None):
+    """Identifies a query on the current version of a city file.
+
+    Args:
+        path (str): path to the city CSV file.
+        months (list): month numbers to keep, all months if empty.
+        days (list): weekday numbers to keep, all days if empty.
+        statistic (str): what is computed from the matching trips.
+        dates (tuple): the date range to keep, see `parse_dates()`; all
+            days if None.
+        hours (tuple): the hour window to keep, see `parse_hours()`; all
+            hours if None.
+
+    Returns:
+        key (tuple): the file, its fingerprint, the normalized filters &
+            the statistic.
+    """
+
+    if dates is not None:
+        dates = tuple(None if day is None else str(day) for day in dates)
+    return (os.path.abspath(path), source_fingerprint(path),
+            tuple(sorted(set(months))), tuple(sorted(set(days))), statistic,
+            dates, hours)
+
+
+def cache_get(cache, key):
+    """Looks a result up in memory, then on disk.
+
+    Args:
+        cache (dict): the cache made by `new_result_cache()`.
+        key (tuple): the key made by `result_key()`.
+
+    Returns:
+        found (bool): whether the result is cached.
+        result: the cached result, None if not found.
+    """
+
+    entries = cache["entries"]
+    if key in entries:
+        entries.move_to_end(key)
+        cache["hits"] += 1
+        return True, entries[key][0]
+
+    if cache["folder"]:
+        try:
+            with open(cached_result_path(cache, key), "rb") as file:
+                result = pickle.load(file)
+            # Mark the file as recently used, see `trim_cache_folder()`
+            os.utime(cached_result_path(cache, key))
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+        else:
+            cache["disk_hits"] += 1
+            cache_put(cache, key, result, persist=False)
+            return True, result
+
+    cache["misses"] += 1
+    return False, None
+
+
+def cache_put(cache, key, result, persist=True):
+    """Stores a result, evicting the least recently used ones if needed.
+
+    Args:
+        cache (dict): the cache made by `new_result_cache()`.
+        key (tuple): the key made by `result_key()`.
+        result: the result to store.
+        persist (bool): whether to also write it to the cache folder.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    payload = pickle.dumps(result)
+    if persist and cache["folder"]:
+        os.makedirs(cache["folder"], exist_ok=True)
+        file_name = cached_result_path(cache, key)
+        with open(f"{file_name}.tmp", "wb") as file:
+            file.write(payload)
+        os.replace(f"{file_name}.tmp", file_name)
+        trim_cache_folder(cache)
+
+    entries = cache["entries"]
+    if key in entries:
+        cache["bytes"] -= entries.pop(key)[1]
+    entries[key] = (result, len(payload))
+    cache["bytes"] += len(payload)
+    while len(entries) > cache["max_entries"] or (
+        cache["bytes"] > cache["max_bytes"] and len(entries) > 1
+    ):
+        cache["bytes"] -= entries.popitem(last=False)[1][1]
+
+
+def trim_cache_folder(cache):
+    """Removes the least recently used result files over the size limit.
+
+    Results of earlier versions of a city file are never asked for again,
+    so they go first once the folder is full.
+
+    Args:
+        cache (dict): the cache made by `new_result_cache()`.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    files = []
+    with os.scandir(cache["folder"]) as entries:
+        for entry in entries:
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+    # Oldest first, keeping at least the newest file
+    total = sum(size for _, size, _ in files)
+    for _, size, file_name in sorted(files)[:-1]:
+        if total <= cache["max_disk_bytes"]:
             break
+        try:
+            os.remove(file_name)
+        except OSError:
+            # Another session may have removed it already
+            pass
+        total -= size
+
+
+def cached_result_path(cache, key):
+    """Names the file persisting a cached result.
+
+    Args:
+        cache (dict): the cache made by `new_result_cache()`.
+        key (tuple): the key made by `result_key()`.
+
+    Returns:
+        path (str): the file in the cache folder.
+    """
+
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()
+    return os.path.join(cache["folder"], f"{digest}.pkl")
+
+
+@traced("analyze_city")
+def analyze_city(source, months=(), days=(), partitions=1, sections=None,
+                 approximate=False, dates=None, hours=None, unified=False):
+    """Computes the statistics of one city without any prompt.
+
+    Args:
+        source (str): a key of CITIES or a path to a city CSV file.
+        months (list): month numbers to keep, all months if empty.
+        days (list): weekday numbers to keep, all days if empty.
+        partitions (int): the number of row partitions processed in
+            parallel, see `parallel_summary()`.
+        sections (list): only read the columns these REPORT_SECTIONS
+            need, all of them if not given.
+        approximate (bool): whether to sketch the trips of a file that is
+            streamed or split into partitions, see `sketch_trips()`; the
+            trips of a file loaded whole are counted exactly, as that is
+            faster than sketching them.
+        dates (tuple): the date range to keep, see `parse_dates()`; all
+            days if None.
+        hours (tuple): the hour window to keep, see `parse_hours()`; all
+            hours if None.
+        unified (bool): whether to only read the months & dates asked for
+            from the partitioned store, see `read_partitions()`.
+
+    Returns:
+        stats (dict): the statistics computed by `describe()`.
+        None: if no trip matches the filters.
+    """
+
+    path = CITIES.get(source, source)
+    if unified:
+        manifest = open_partitions(path)
+        present = [c for c in STORE_SCHEMA if c not in manifest["missing"]]
+        data = read_partitions(path, months, dates,
+                               csv_columns(present, sections))
+        data = get_data_ready(data, verbose=False)
+        summary = summarize(match_rows(data, (), days, dates, hours))
+    elif os.path.getsize(path) > STREAMING_SIZE:
+        summary = stream_summary(path, months, days, sections=sections,
+                                 approximate=approximate, dates=dates,
+                                 hours=hours)
+    elif partitions > 1:
+        summary = parallel_summary(path, months, days, partitions, sections,
+                                   approximate, dates, hours)
+    else:
+        data = read_city_data(path)
+        data = get_data_ready(data[csv_columns(data.columns, sections)],
+                              verbose=False)
+        summary = summarize(match_rows(data, months, days, dates, hours))
+    return describe(summary) if summary and summary["trips"] else None
+
+
+@traced("batch_report")
+def batch_report(sources=None, months=(), days=(), workers=None,
+                 partitions=1, cache=None, sections=None, approximate=False,
+                 dates=None, hours=None, unified=False):
+    """Computes the statistics of several cities in parallel processes.
+
+    Args:
+        sources (list): keys of CITIES or paths to city CSV files, all
+            the cities if not given.
+        months (list): month numbers to keep, all months if empty.
+        days (list): weekday numbers to keep, all days if empty.
+        workers (int): the number of processes, one per city if not given.
+        partitions (int): if more than one, the cities are rather analyzed
+            one by one, each split over this many processes (as is a single
+            city, in this process).
+        cache (dict): a cache made by `new_result_cache()`, only the
+            sources missing from it are analyzed.
+        sections (list): only use the columns these REPORT_SECTIONS need,
+            see `analyze_city()`; all of them if not given.
+        approximate (bool): whether to sketch the trips, see
+            `sketch_trips()`.
+        dates (tuple): the date range to keep, see `parse_dates()`; all
+            days if None.
+        hours (tuple): the hour window to keep, see `parse_hours()`; all
+            hours if None.
+        unified (bool): whether to read the partitioned stores, see
+            `analyze_city()`.
+
+    Returns:
+        report (dict): the statistics of each source, in the given order.
+    """
+
+    sources = list(sources or CITIES)
+    if cache is not None:
+        statistic = ",".join(sections) if sections is not None else "all"
+        if approximate:
+            statistic += ",approximate"
+        keys = {s: result_key(CITIES.get(s, s), months, days, statistic,
+                              dates, hours)
+                for s in sources}
+        report = {s: cache_get(cache, keys[s]) for s in sources}
+        missing = [s for s in sources if not report[s][0]]
+        if missing:
+            computed = batch_report(missing, months, days, workers,
+                                    partitions, sections=sections,
+                                    approximate=approximate, dates=dates,
+                                    hours=hours, unified=unified)
+            for source, stats in computed.items():
+                cache_put(cache, keys[source], stats)
+                report[source] = (True, stats)
+        return {source: report[source][1] for source in sources}
+
+    if partitions > 1 or len(sources) == 1:
+        return {source: analyze_city(source, months, days, partitions,
+                                     sections, approximate, dates, hours,
+                                     unified)
+                for source in sources}
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers or len(sources)
+    ) as executor:
+        futures = [executor.submit(analyze_city, source, months, days, 1,
+                                   sections, approximate, dates, hours,
+                                   unified)
+                   for source in sources]
+        return {source: future.result()
+                for source, future in zip(sources, futures)}
+
+
+def select_stats(stats, sections=REPORT_SECTIONS):
+    """Keeps the statistics of some report sections.
+
+    Args:
+        stats (dict): the statistics computed by `describe()`.
+        sections (list): names of REPORT_SECTIONS to keep.
+
+    Returns:
+        stats (dict): the trip count, the statistics of these sections &
+            the error bounds of those that are approximate, if any.
+        None: if `stats` is None.
+    """
+
+    if stats is None:
+        return None
+    names = ["trips"] + [n for s in sections for n in REPORT_SECTIONS[s]]
+    selected = {name: stats[name] for name in names}
+    bounds = {name: bound
+              for name, bound in (stats["error_bounds"] or {}).items()
+              if name in names}
+    if bounds:
+        selected["error_bounds"] = bounds
+    return selected
 
-        # Continue with the analysis process
-        city_data = get_data_ready(city_raw_data)
 
-        # Explore data
-        explore_data(city_data)
+def print_report(report, sections=REPORT_SECTIONS):
+    """Displays the statistics of several cities one after the other.
 
-        # Filter data
-        city_data_filtered = filter_data(city_data)
+    Args:
+        report (dict): the statistics of each city, see `batch_report()`.
+        sections (list): names of REPORT_SECTIONS to display.
+
+    Returns:
+        This function returns nothing.
+    """
 
-        # Display time stats
+    printers = {"time": time_stats, "station": station_stats,
+                "duration": trip_duration_stats, "user": user_stats}
+    for source, stats in report.items():
+        print(f"\n{source}:")
         print("*" * 20)
-        time_stats(city_data_filtered)
+        if stats is None:
+            print("There are no trips matching these filters!")
+            continue
+        for section in sections:
+            printers[section](stats)
+
 
-        # Display station stats
-        station_stats(city_data_filtered)
+def main():
+    """Executes the script."""
 
-        # Display trip duration stats
-        trip_duration_stats(city_data_filtered)
+    outer_loop = True
+    while outer_loop:
+        # Choose the data
+        city = ask_city()
 
-        # Display user stats
-        user_stats(city_data_filtered)
+        # Give the user the option to quit
+        if city is None:
+            break
+        remember_city(city)
+
+        if os.path.getsize(CITIES[city]) > STREAMING_SIZE:
+            # Too big to be loaded, so aggregate it chunk by chunk
+            explore_data(open_cursor(CITIES[city]))
+            months, days, dates, hours = ask_filters()
+            approximate = input(
+                "\nApproximate the most common trip, which is faster? (y/n) "
+            ).strip().lower() == "y"
+            print("\nStreaming data..")
+            t_0 = time.perf_counter_ns()
+            summary = stream_summary(CITIES[city], months, days,
+                                     approximate=approximate, dates=dates,
+                                     hours=hours)
+            print_load_stats(t_0)
+        else:
+            # Load & process the data in the background (unless it was
+            # prefetched), while exploring the raw data from the file
+            print("\nLoading data..")
+            t_0 = time.perf_counter_ns()
+            loading = load_city(CITIES[city])
+            explore_data(open_cursor(CITIES[city]))
+            if not loading.done():
+                print("\nStill loading data..")
+            _, city_cube, time_index, t_1 = loading.result()
+            print_load_stats(t_0, max(t_0, t_1))
+
+            # Filter data, answering the statistics from the cube, or from
+            # the ranges of trips sorted by start time for dates & hours
+            months, days, dates, hours = ask_filters()
+            if months or days or dates or hours:
+                print("\nFiltering data..")
+            if dates is None and hours is None:
+                summary = query_cube(city_cube, months, days)
+            else:
+                ranges = select_ranges(time_index, months, days, dates, hours)
+                summary = summarize(slice_ranges(time_index, ranges))
+            if months or days or dates or hours:
+                print("Done!")
+
+        if summary["trips"]:
+            city_stats = describe(summary)
+
+            # Display time stats
+            print("*" * 20)
+            time_stats(city_stats)
+
+            # Display station stats
+            station_stats(city_stats)
+
+            # Display trip duration stats
+            trip_duration_stats(city_stats)
+
+            # Display user stats
+            user_stats(city_stats)
+
+            # Offer the exact statistics in place of the approximate ones
+            if city_stats["error_bounds"] and input(
+                "\nRecompute them exactly? (y/n) "
+            ).strip().lower() == "y":
+                print("\nStreaming data..")
+                summary = stream_summary(CITIES[city], months, days,
+                                         dates=dates, hours=hours)
+                print("Done!")
+                print("*" * 20)
+                station_stats(describe(summary))
+        else:
+            print("\nThere are no trips matching these filters!")
 
         # Ask if the user wants to repeat the whole process
         print("\nYou can proceed to analyzing another dataset if you would like!")
@@ -360,6 +3342,182 @@ def main():
                 print("\nRestarting..")
                 break
 
+    # Don't start the background loads nobody is waiting for anymore
+    stop_prefetch()
+
+
+def city_source(text):
+    """Reads a city name, in any case, or a path to a city CSV file.
+
+    Args:
+        text (str): the command line value.
+
+    Returns:
+        source (str): the key of CITIES, or the path as given.
+
+    Raises:
+        argparse.ArgumentTypeError: if it is neither a city nor a file.
+    """
+
+    if text.title() in CITIES:
+        return text.title()
+    if os.path.isfile(text):
+        return text
+    raise argparse.ArgumentTypeError(
+        f"{text!r} is neither one of {', '.join(CITIES)} nor a file"
+    )
+
+
+def parse_args(argv=None):
+    """Reads the command line options.
+
+    Args:
+        argv (list): the arguments, those of the script if not given.
+
+    Returns:
+        args (argparse.Namespace): the parsed options.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Explore US bikeshare data, interactively if no city "
+                    "is given.",
+    )
+    parser.add_argument(
+        "--city", type=city_source,
+        help="report on this city or CSV file without prompting",
+    )
+    parser.add_argument(
+        "--batch", nargs="*", type=city_source, metavar="CITY",
+        help="report on these cities or CSV files (all cities if none given) "
+             "without prompting",
+    )
+    parser.add_argument(
+        "--workers", type=int,
+        help="the number of processes used by --batch",
+    )
+    parser.add_argument(
+        "--partitions", type=int, default=1,
+        help="split each city into this many row partitions, "
+             "aggregated in parallel processes",
+    )
+    parser.add_argument(
+        "--unified", action="store_true",
+        help="read each city from its store partitioned by year & month, "
+             "skipping the months filtered out; takes precedence over "
+             "--partitions & the streaming of large files",
+    )
+    parser.add_argument(
+        "--months", nargs="+", type=str.title, choices=MONTHS, default=[],
+        metavar="MONTH", help="only keep the trips of these months",
+    )
+    parser.add_argument(
+        "--days", nargs="+", type=str.title, choices=DAYS, default=[],
+        metavar="DAY", help="only keep the trips of these weekdays",
+    )
+    parser.add_argument(
+        "--dates", type=parse_dates, metavar="FIRST..LAST",
+        help="only keep the trips of these dates, e.g. "
+             "2017-03-01..2017-03-15; either end may be left out",
+    )
+    parser.add_argument(
+        "--hours", type=parse_hours, metavar="FIRST-STOP",
+        help="only keep the trips starting in this hour window, e.g. 7-10 "
+             "from 7 to 10 AM, or 22-2 overnight",
+    )
+    parser.add_argument(
+        "--stats", nargs="+", choices=REPORT_SECTIONS,
+        default=list(REPORT_SECTIONS), help="the report sections to show",
+    )
+    parser.add_argument(
+        "--format", choices=["text", "json"], default="text",
+        help="how to write the report",
+    )
+    parser.add_argument(
+        "--approximate", action="store_true",
+        help="sketch the trips of streamed files & --partitions rather than "
+             "count each distinct one, which makes merging their partial "
+             "counts faster; the most common trip comes with error bounds. "
+             "Files loaded whole are always counted exactly",
+    )
+    parser.add_argument(
+        "--append", metavar="DELTA",
+        help="first append the rows of this CSV file to the --city file, "
+             "updating its column store with them only",
+    )
+    parser.add_argument(
+        "--result-cache", action="store_true",
+        help=f"reuse the statistics saved in {RESULT_CACHE_FOLDER} by "
+             "earlier runs & save new ones there",
+    )
+    parser.add_argument(
+        "--prefetch", nargs="?", type=int, const=2, metavar="WORKERS",
+        help="when prompting, load every city in this many background "
+             "threads (2 if not given) from the start, the last one chosen "
+             "first",
+    )
+    parser.add_argument(
+        "--trace", metavar="FILE",
+        help="record how long each stage takes, the rows it processes & "
+             "the memory it allocates, and write it to this file",
+    )
+    parser.add_argument(
+        "--trace-format", choices=["json", "chrome"], default="json",
+        help="write the trace as span records, or as a Chrome trace",
+    )
+    parser.add_argument(
+        "--trace-memory", action=argparse.BooleanOptionalAction, default=True,
+        help="measure the memory allocated by each stage with tracemalloc, "
+             "which slows the traced run down",
+    )
+    return parser.parse_args(argv)
+
+
+def run(args):
+    """Runs the analysis asked for on the command line, without prompting.
+
+    Args:
+        args (argparse.Namespace): the options read by `parse_args()`.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    months = [MONTHS.index(month) + 1 for month in args.months]
+    days = [DAYS.index(day) for day in args.days]
+    cache = new_result_cache(
+        folder=RESULT_CACHE_FOLDER if args.result_cache else None
+    )
+
+    if args.city:
+        sources = [args.city]
+        if args.append:
+            append_csv(CITIES.get(args.city, args.city), args.append)
+    else:
+        sources = args.batch
+    # Only parse the columns of the asked sections, unless all are asked
+    sections = None if set(args.stats) == set(REPORT_SECTIONS) else args.stats
+    report = batch_report(sources, months, days, args.workers, args.partitions,
+                          cache, sections, args.approximate, args.dates,
+                          args.hours, args.unified)
+
+    if args.format == "json":
+        print(json.dumps({source: select_stats(stats, args.stats)
+                          for source, stats in report.items()}, indent=2))
+    else:
+        print_report(report, args.stats)
+
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.trace:
+        start_trace(args.trace_memory)
+    try:
+        if args.city or args.batch is not None:
+            run(args)
+        else:
+            if args.prefetch:
+                start_prefetch(args.prefetch)
+            main()
+    finally:
+        if args.trace:
+            write_trace(stop_trace(), args.trace, args.trace_format)
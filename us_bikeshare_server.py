@@ -0,0 +1,360 @@
+import argparse
+import asyncio
+import json
+import time
+import urllib.parse
+
+import us_bikeshare_optimized as bikeshare
+
+# The warm datasets: the source fingerprint & the load of each city
+DATASETS = {}
+
+# The statistics answered so far, see `serve()` for its limits
+RESULTS = bikeshare.new_result_cache()
+
+
+def load_cube(path):
+    """Loads, processes & pre-aggregates a city file.
+
+    Args:
+        path (str): path to the city CSV file.
+
+    Returns:
+        cube (dict): the cube built by `build_cube()`.
+        offset (int): how far in the file the column store was, None if
+            the data didn't come from the store.
+    """
+
+    data = bikeshare.read_city_data(path)
+    meta = bikeshare.read_meta(path)
+    offset = meta["offset"] if meta and meta["rows"] == len(data) else None
+    data = bikeshare.get_data_ready(data, verbose=False)
+    return bikeshare.build_cube(data), offset
+
+
+def refresh_cube(path, cube, offset):
+    """Brings the cube of a city up to date with its file.
+
+    If rows were only appended since the cube was built, just those rows
+    are read, pre-aggregated & merged in; otherwise the file is reloaded.
+
+    Args:
+        path (str): path to the city CSV file.
+        cube (dict): the cube of the file as it was.
+        offset (int): how far in the file the store was for that cube.
+
+    Returns:
+        cube (dict): the cube of the file as it is now.
+        offset (int): how far in the file the store is now.
+    """
+
+    delta = None
+    with bikeshare.store_lock(path):
+        meta = bikeshare.read_meta(path)
+        if offset is not None and meta and meta["offset"] == offset:
+            delta = bikeshare.append_to_cache(path)
+    if delta is None:
+        return load_cube(path)
+
+    delta = bikeshare.get_data_ready(delta, verbose=False)
+    cube = bikeshare.merge_cubes(cube, bikeshare.build_cube(delta))
+    return cube, bikeshare.read_meta(path)["offset"]
+
+
+async def reload_cube(path, previous):
+    """Loads a city again once its file changed, from its old cube if any.
+
+    Args:
+        path (str): path to the city CSV file.
+        previous (asyncio.Future): the earlier load of the city.
+
+    Returns:
+        cube (dict): the cube built by `build_cube()`.
+        offset (int): how far in the file the store is.
+    """
+
+    loop = asyncio.get_running_loop()
+    try:
+        cube, offset = await previous
+    except Exception:
+        return await loop.run_in_executor(None, load_cube, path)
+    return await loop.run_in_executor(None, refresh_cube, path, cube, offset)
+
+
+async def get_cube(city):
+    """Gets the cube of a city, loading it in a worker thread if needed.
+
+    Concurrent queries for a city that is being loaded wait for the same
+    load, and a city is refreshed once its file changes.
+
+    Args:
+        city (str): a key of CITIES.
+
+    Returns:
+        cube (dict): the cube built by `build_cube()`.
+    """
+
+    path = bikeshare.CITIES[city]
+    fingerprint = bikeshare.source_fingerprint(path)
+    if city not in DATASETS:
+        loop = asyncio.get_running_loop()
+        DATASETS[city] = (fingerprint,
+                          loop.run_in_executor(None, load_cube, path))
+    elif DATASETS[city][0] != fingerprint:
+        DATASETS[city] = (fingerprint, asyncio.ensure_future(
+            reload_cube(path, DATASETS[city][1])
+        ))
+    try:
+        cube, _ = await DATASETS[city][1]
+        return cube
+    except Exception:
+        DATASETS.pop(city, None)
+        raise
+
+
+def parse_names(values, names):
+    """Reads a comma separated query parameter of day or month names.
+
+    Args:
+        values (list): the values of the parameter.
+        names (list): the valid names, DAYS or MONTHS.
+
+    Returns:
+        positions (list): the position of each name in `names`.
+
+    Raises:
+        ValueError: if a value is not one of the names.
+    """
+
+    words = [w.strip().title() for v in values for w in v.split(",") if w]
+    unknown = [w for w in words if w not in names]
+    if unknown:
+        raise ValueError(f"unknown name(s): {', '.join(unknown)}")
+    return [names.index(w) for w in words]
+
+
+def query_stats(cube, months, days, sections):
+    """Computes the statistics of a query from the cube of its city.
+
+    Args:
+        cube (dict): the cube built by `build_cube()`.
+        months (list): month numbers to keep, all months if empty.
+        days (list): weekday numbers to keep, all days if empty.
+        sections (list): names of REPORT_SECTIONS to answer.
+
+    Returns:
+        stats (dict): the statistics of these sections, see
+            `select_stats()`.
+        None: if no trip matches the filters.
+    """
+
+    summary = bikeshare.query_cube(cube, months, days)
+    if not summary["trips"]:
+        return None
+    return bikeshare.select_stats(bikeshare.describe(summary), sections)
+
+
+def query_routes(cube, months, days, top):
+    """Finds the routes of a query from the origin-destination matrix.
+
+    Args:
+        cube (dict): the cube built by `build_cube()`.
+        months (list): month numbers to keep, all months if empty.
+        days (list): weekday numbers to keep, all days if empty.
+        top (int): the number of trips & stations to list.
+
+    Returns:
+        body (dict): the most common trips, then the stations gaining &
+            losing the most bikes, with their inbound & outbound trips;
+            all empty if no trip matches the filters.
+    """
+
+    summary = bikeshare.query_cube(cube, months, days)
+    matrix = bikeshare.od_matrix(summary["trip"], summary["stations"])
+    flows = bikeshare.station_flows(matrix).reset_index(names="station")
+
+    # Only the stations some of the trips leave or reach are listed
+    flows = flows[(flows["outbound"] > 0) | (flows["inbound"] > 0)]
+    return {
+        "trips": [list(route) for route in bikeshare.top_routes(matrix, top)],
+        "arrivals": flows.nlargest(top, "net").to_dict("records"),
+        "departures": flows.nsmallest(top, "net").to_dict("records"),
+    }
+
+
+async def answer(target):
+    """Answers a `/stats` or `/routes` query, or reports the result cache
+    counters.
+
+    Args:
+        target (str): the request target, as in
+            "/stats?city=Chicago&months=June&days=Monday,Sunday&stats=time"
+            or "/routes?city=Chicago&months=June&top=10".
+
+    Returns:
+        status (str): the HTTP status line.
+        body (dict): the statistics & the query latency, or an error.
+    """
+
+    t_0 = time.perf_counter()
+    url = urllib.parse.urlsplit(target)
+    if url.path == "/cache":
+        return "200 OK", {name: RESULTS[name] for name in
+                          ("hits", "disk_hits", "misses", "bytes")}
+    if url.path not in ("/stats", "/routes"):
+        return "404 Not Found", {
+            "error": "only /stats, /routes & /cache are served"
+        }
+
+    query = urllib.parse.parse_qs(url.query)
+    city = query.get("city", [""])[0].title()
+    if city not in bikeshare.CITIES:
+        return "400 Bad Request", {"error": f"unknown city: {city!r}"}
+    try:
+        months = [m + 1 for m in parse_names(query.get("months", []),
+                                             bikeshare.MONTHS)]
+        days = parse_names(query.get("days", []), bikeshare.DAYS)
+        sections = [s for v in query.get("stats", []) for s in v.split(",")]
+        if any(s not in bikeshare.REPORT_SECTIONS for s in sections):
+            raise ValueError(f"unknown section(s) in {sections}")
+        top = int(query.get("top", [bikeshare.TOP_TRIPS])[0])
+        if top < 1:
+            raise ValueError(f"top must be at least 1, not {top}")
+    except ValueError as error:
+        return "400 Bad Request", {"error": str(error)}
+
+    # Queries are answered in worker threads, so the loop keeps serving
+    loop = asyncio.get_running_loop()
+    if url.path == "/routes":
+        body = await loop.run_in_executor(None, query_routes,
+                                          await get_cube(city), months, days,
+                                          top)
+        return "200 OK", {
+            "city": city,
+            **body,
+            "latency_ms": round((time.perf_counter() - t_0) * 1000, 3),
+        }
+
+    sections = sections or list(bikeshare.REPORT_SECTIONS)
+    key = bikeshare.result_key(bikeshare.CITIES[city], months, days,
+                               ",".join(sections))
+    cached, stats = bikeshare.cache_get(RESULTS, key)
+    if not cached:
+        stats = await loop.run_in_executor(None, query_stats,
+                                           await get_cube(city), months, days,
+                                           sections)
+        bikeshare.cache_put(RESULTS, key, stats)
+
+    return "200 OK", {
+        "city": city,
+        "stats": stats,
+        "cached": cached,
+        "latency_ms": round((time.perf_counter() - t_0) * 1000, 3),
+    }
+
+
+async def handle(reader, writer):
+    """Serves one HTTP request & closes the connection.
+
+    Args:
+        reader (asyncio.StreamReader): the request stream.
+        writer (asyncio.StreamWriter): the response stream.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    t_0 = time.perf_counter()
+    request_line = (await reader.readline()).decode("latin-1")
+    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+        pass
+
+    try:
+        method, target, _ = request_line.split(" ", 2)
+        if method != "GET":
+            status, body = "405 Method Not Allowed", {"error": "GET only"}
+        else:
+            status, body = await answer(target)
+    except ValueError:
+        target, status, body = "", "400 Bad Request", {"error": "bad request"}
+    except Exception as error:
+        status, body = "500 Internal Server Error", {"error": str(error)}
+
+    payload = json.dumps(body).encode()
+    writer.write(
+        f"HTTP/1.1 {status}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(payload)}\r\n"
+        f"Connection: close\r\n\r\n".encode() + payload
+    )
+    await writer.drain()
+    writer.close()
+
+    t_delta = (time.perf_counter() - t_0) * 1000
+    print(f"{status[:3]} {target} {round(t_delta, 3)} ms", flush=True)
+
+
+async def serve(args):
+    """Preloads the asked cities & serves queries until interrupted.
+
+    Args:
+        args (argparse.Namespace): the options read by `parse_args()`.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    RESULTS["max_entries"] = args.cache_entries
+    RESULTS["max_bytes"] = args.cache_bytes
+
+    if args.socket:
+        server = await asyncio.start_unix_server(handle, path=args.socket)
+    else:
+        server = await asyncio.start_server(handle, args.host, args.port)
+
+    for city in args.preload:
+        await get_cube(city)
+        print(f"{city} is loaded.", flush=True)
+
+    where = args.socket or f"http://{args.host}:{args.port}"
+    print(f"Serving /stats & /routes on {where}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def parse_args(argv=None):
+    """Reads the command line options.
+
+    Args:
+        argv (list): the arguments, those of the script if not given.
+
+    Returns:
+        args (argparse.Namespace): the parsed options.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Serve US bikeshare statistics from warm datasets.",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--socket", help="serve on this Unix socket instead")
+    parser.add_argument(
+        "--preload", nargs="*", type=str.title, choices=bikeshare.CITIES,
+        default=[], metavar="CITY", help="cities to load before serving",
+    )
+    parser.add_argument(
+        "--cache-entries", type=int, default=1024,
+        help="the number of answers kept in the result cache",
+    )
+    parser.add_argument(
+        "--cache-bytes", type=int, default=64 * 1024**2,
+        help="the total size of the answers kept in the result cache",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
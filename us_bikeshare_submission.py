@@ -1,6 +1,8 @@
 # Importing necessary libraries:
 import pandas as pd
 import datetime as dt
+import calendar
+from us_bikeshare_optimized import read_city_data, intern_stations, pack_trips, trip_seconds, build_filter_index, select_rows, open_cursor, read_page
 
 
 # Defining the available data sets & their associated file names:
@@ -71,6 +73,7 @@ def loading_func(cities):
     
     Returns:
     (pandas dataframe) the required data set.
+    (dict) the bitmap index of its days & months, used when filtering.
     """
 
     while True:
@@ -99,71 +102,90 @@ To change it enter the new name: ''').strip().title()
             # Loading data:
             print(f'\nLoading data for {city}..')
             folder = './data/'
-            df = pd.read_csv(folder+file_name, parse_dates=['Start Time', 'End Time']).drop(columns='Unnamed: 0')
+            df = read_city_data(folder+file_name)
             print('Done!')
 
             # Renaming columns for more convenience:
             df.rename(columns=lambda x: x.strip().lower().replace(' ', '_'), inplace=True)
 
             # Creating the necessary extra columns:
-            df['start_day'] = df['start_time'].dt.strftime('%A')
-            df['start_month'] = df['start_time'].dt.strftime('%B')
-            df['start_hour'] = df['start_time'].dt.strftime('%H')
-            df['start_to_end'] = 'from ' + df['start_station'] + ' to ' + df['end_station']
+            # (day: 0 for Monday, month: 1 for January, hour: 0 - 23, named when printed)
+            df['start_day'] = df['start_time'].dt.dayofweek.astype('int8')
+            df['start_month'] = df['start_time'].dt.month.astype('int8')
+            df['start_hour'] = df['start_time'].dt.hour.astype('int8')
+
+            # Timing each trip in whole seconds, from its start & end times:
+            df['trip_duration'] = trip_seconds(df['start_time'], df['end_time'])
+
+            # Encoding trips as station code pairs & naming each distinct trip once:
+            stations = intern_stations(df)
+            trips = pack_trips(df['start_station'], df['end_station'])
+            trip_codes, unique_trips = pd.factorize(pd.arrays.IntegerArray(trips, trips < 0))
+            unique_trips = unique_trips.to_numpy(dtype='int64')
+            trip_names = 'from ' + stations[unique_trips // len(stations)] + ' to ' + stations[unique_trips % len(stations)]
+            df['start_to_end'] = pd.Categorical.from_codes(trip_codes, trip_names)
+
+            # Indexing the rows of every day & month once, for all filters:
+            index = build_filter_index(df, month='start_month', day='start_day')
 
             # Ending the loop
             break
             
-    return city, df
+    return city, df, index
 
 
 # Defining a function to explore the raw data::
-def exploring_func(df):
+def exploring_func(file_path):
     
     """
     Asks for the number of rows by which the data set will be viewed.
     
     Args:
-    (pandas dataframe) the data set to be explored.
+    (str) the path of the data set to be explored.
     
     Returns:
     printing out the data according to the required number of rows.
     """
     
-    i = 0
+    # Opening a cursor over the raw rows, only the viewed ones are decoded:
+    cursor = open_cursor(file_path)
     while True:
         
         # Handling errors:
         try:
             # Asking for number of rows:
             print('\nYou can explore data by viewing a defined numer of rows at a time,')
-            explore = input('Number of rows (to skip press enter): ').strip()
+            print('(to jump to a row, type it after the number of rows)')
+            explore = input('Number of rows (to skip press enter): ').strip().split()
             
             # Validating input(s):
-            if explore != '' and not explore.isnumeric():
+            if len(explore) > 2 or not all(x.isnumeric() for x in explore):
                 raise ValueError
                 
         except ValueError:
             print('\nPlease, enter the number correctly!')
             
         else:
-            if explore == '':
+            if not explore:
                 break
             else:
-                rows = int(explore)
+                if len(explore) == 2:
+                    cursor['row'] = int(explore[1])
+                page = read_page(cursor, cursor['row'], int(explore[0]))
                 print('\n')
-                print(df[i:i+rows])
-                i += rows
+                print(page)
+                cursor['row'] += len(page)
 
 
 # Defining a function to filter the data:
-def filtering_func(df):
+def filtering_func(df, index):
     
     """
     Asks for the time frame by which the data will be filtered.
     
     Args:
     (pandas dataframe) the data set to be filtered.
+    (dict) the bitmap index of the data set, built when loading it.
     
     Returns:
     (pandas dataframe) the data set after being filtered.
@@ -191,11 +213,12 @@ def filtering_func(df):
             print('\nWhich month - January, February, March, April, May, or June?')
             month = input('You can enter more than one day separated by a space: ').strip().title().split(' ')
             
-            time_filter = day + month
-            time_filter =[ x for x in time_filter if x in df[['start_day', 'start_month']].to_numpy()]
+            # Converting names to the numbers stored in start_day & start_month:
+            days = [list(calendar.day_name).index(x) for x in day if x in calendar.day_name]
+            months = [list(calendar.month_name).index(x) for x in month if x in calendar.month_name[1:]]
 
             # Validating inputs:
-            if len(time_filter) == 0:
+            if len(days) + len(months) == 0:
                 raise Exception
 
         # Handling errors:
@@ -204,9 +227,8 @@ def filtering_func(df):
 
         else:
             
-            # Defining & applying mask:
-            filter_by = df[['start_day', 'start_day']].isin(time_filter).any(axis=1)
-            df = df.query("@filter_by").copy()
+            # Selecting the chosen days of the chosen months from the bitmap index:
+            df = df[select_rows(index, months, days)]
             
             # Ending loop:
             break
@@ -215,45 +237,79 @@ def filtering_func(df):
 
 
 # Defining available options for statistics & their associated result name, column name, action:
+# (each action takes the value counts of its column, sorted by value)
 options = {'1': {'result': 'Most common month:',
                  'column': 'start_month',
-                 'return_func': lambda series: series.mode()[0]},
+                 'return_func': lambda counts: calendar.month_name[counts.idxmax()]},
            '2': {'result': 'Most common day of the week:',
                  'column': 'start_day',
-                 'return_func': lambda series: series.mode()[0]},
+                 'return_func': lambda counts: calendar.day_name[counts.idxmax()]},
            '3': {'result': 'Most common hour of the day:',
                  'column': 'start_hour',
-                 'return_func': lambda series: series.mode()[0]},
+                 'return_func': lambda counts: f'{counts.idxmax():02d}'},
            '4': {'result': 'Most common start station:',
                  'column': 'start_station',
-                 'return_func': lambda series: series.mode()[0]},
+                 'return_func': lambda counts: counts.idxmax()},
            '5': {'result': 'Most common end station:',
                  'column': 'end_station',
-                 'return_func': lambda series: series.mode()[0]},
+                 'return_func': lambda counts: counts.idxmax()},
            '6': {'result': 'Most common trip from start to end:',
                  'column': 'start_to_end',
-                 'return_func': lambda series: series.mode()[0]},
+                 'return_func': lambda counts: counts.idxmax()},
            '7': {'result': 'Total travel time (in hours):',
-                 'column': 'trip_uration',
-                 'return_func': lambda series: series.sum()},
+                 'column': 'trip_duration',
+                 'return_func': lambda counts: round((counts.index * counts).sum() / 3600, 2)},
            '8': {'result': 'Average travel time (in hours):',
                  'column': 'trip_duration',
-                 'return_func': lambda series: round(series.mean(), 2)},
+                 'return_func': lambda counts: round((counts.index * counts).sum() / counts.sum() / 3600, 2)},
            '9': {'result': 'Counts of each user type:\n',
                  'column': 'user_type',
-                 'return_func': lambda series: series.value_counts().to_dict()},
+                 'return_func': lambda counts: counts.sort_values(ascending=False, kind='stable').to_dict()},
            '10': {'result': 'Counts of each gender:\n',
                   'column': 'gender',
-                  'return_func': lambda series: series.value_counts().to_dict()},
+                  'return_func': lambda counts: counts.sort_values(ascending=False, kind='stable').to_dict()},
            '11': {'result': 'Earliest year of birth:',
                   'column': 'birth_year',
-                  'return_func': lambda series: int(series.min())},
+                  'return_func': lambda counts: int(counts[counts > 0].index.min())},
            '12': {'result': 'Most recent year of birth:',
                   'column': 'birth_year',
-                  'return_func': lambda series: int(series.max())},
+                  'return_func': lambda counts: int(counts[counts > 0].index.max())},
            '13': {'result': 'Most common year of birth:',
                   'column': 'birth_year',
-                  'return_func': lambda series: int(series.mode()[0])}}
+                  'return_func': lambda counts: int(counts.idxmax())}}
+
+
+# Defining a function to compute all statistics at once:
+def computing_statistics(options, df):
+    
+    """
+    Computes every available statistic, reading each column only once.
+    
+    Args:
+    (dict) a dictionary containing the available options for statistics.
+    (pandas dataframe) the data set to be analyzed.
+    
+    Returns:
+    (dict) the result of each option, None if its column is not available.
+    """
+    
+    # Counting the values of each required column in one pass:
+    counts = {}
+    for associated_dict in options.values():
+        column = associated_dict['column']
+        if column in df.columns and column not in counts:
+            counts[column] = df[column].value_counts(sort=False).sort_index()
+
+    # Deriving every statistic from the counts:
+    results = {}
+    for number, associated_dict in options.items():
+        column = associated_dict['column']
+        if column in counts:
+            results[number] = associated_dict['return_func'](counts[column])
+        else:
+            results[number] = None
+    
+    return results
 
 
 # Defining printing_func:
@@ -271,6 +327,8 @@ def printing_statistics(options, df):
     
     """
     
+    results = computing_statistics(options, df)
+
     outer_loop = True
     while outer_loop:
         
@@ -314,20 +372,16 @@ Or you can skip at anytime by pressing enter.''')
             if option == 'all':
                 for number, associated_dict in options.items():
                     result = associated_dict['result']
-                    column = associated_dict['column']
-                    if column not in df.columns:
+                    if results[number] is None:
                         print(f'{number}.', result, 'Not available for this data set!')
                     else:
-                        return_func = associated_dict['return_func']
-                        print(f'{number}.', result, return_func(df[column]))
+                        print(f'{number}.', result, results[number])
             else:
                 result = options[option]['result']
-                column = options[option]['column']
-                if column not in df.columns:
+                if results[option] is None:
                     print(result, 'Not available for this data set!')
                 else:
-                    return_func = options[option]['return_func']
-                    print(result, return_func(df[column]))
+                    print(result, results[option])
                                 
         finally:
             inner_loop = True
@@ -348,9 +402,9 @@ def main():
     outer_loop = True
     while outer_loop:
         name = greeting_func()
-        city, original_data = loading_func(cities)
-        exploring_func(original_data)
-        filtered_data = filtering_func(original_data)
+        city, original_data, index = loading_func(cities)
+        exploring_func('./data/' + cities[city])
+        filtered_data = filtering_func(original_data, index)
         printing_statistics(options, filtered_data)
         
         print(f'''
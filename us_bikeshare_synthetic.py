@@ -0,0 +1,237 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import us_bikeshare_optimized as bikeshare
+
+# The shape of each city file: its stations, riders & the columns it has
+CITY_SHAPES = {
+    "Chicago": {
+        "stations": 585,
+        "user_types": {"Subscriber": 0.81, "Customer": 0.189,
+                       "Dependent": 0.001},
+        "missing_user_type": 0.0001,
+        "demographics": True,
+        "missing_gender": 0.19,
+        "whole_seconds": True,
+    },
+    "New York": {
+        "stations": 800,
+        "user_types": {"Subscriber": 0.89, "Customer": 0.11},
+        "missing_user_type": 0.0023,
+        "demographics": True,
+        "missing_gender": 0.1,
+        "whole_seconds": True,
+    },
+    "Washington": {
+        "stations": 480,
+        "user_types": {"Subscriber": 0.73, "Customer": 0.27},
+        "missing_user_type": 0.0,
+        "demographics": False,
+        "missing_gender": 0.0,
+        "whole_seconds": False,
+    },
+}
+
+# The first half of 2017, ridership growing into the summer
+FIRST_DAY = np.datetime64("2017-01-01")
+MONTH_WEIGHTS = np.array([0.08, 0.09, 0.12, 0.17, 0.24, 0.30])
+MONTH_DAYS = np.array([31, 28, 31, 30, 31, 30])
+
+# Trips by hour of the day: commuting peaks on weekdays, afternoons else
+WEEKDAY_HOURS = np.array([2, 1, 1, 1, 2, 6, 25, 60, 75, 35, 25, 30,
+                          38, 38, 35, 42, 70, 95, 65, 38, 25, 17, 11, 6.0])
+WEEKEND_HOURS = np.array([6, 4, 3, 1, 1, 2, 5, 10, 22, 38, 52, 62,
+                          68, 70, 68, 64, 58, 50, 40, 30, 22, 16, 12, 8.0])
+WEEKEND_SHARE = 0.22
+
+
+def station_names(n_stations, rng):
+    """Makes up street-corner station names.
+
+    Args:
+        n_stations (int): the number of stations.
+        rng (np.random.Generator): the random generator.
+
+    Returns:
+        names (np.ndarray): distinct station names, in popularity order.
+    """
+
+    streets = [f"{n} St" for n in range(1, 120)] + [
+        f"{name} Ave" for name in ("Lake", "Park", "Union", "Madison",
+                                   "Grand", "State", "Clark", "Halsted",
+                                   "Western", "Ashland", "Kedzie", "Canal")
+    ]
+    corners = pd.MultiIndex.from_product([streets, streets]).to_frame()
+    corners = corners[corners[0] < corners[1]].sample(n_stations,
+                                                      random_state=rng)
+    return (corners[0] + " & " + corners[1]).to_numpy()
+
+
+def trip_days(n_rows, rng):
+    """Draws the day of each trip, as days since FIRST_DAY.
+
+    Args:
+        n_rows (int): the number of trips.
+        rng (np.random.Generator): the random generator.
+
+    Returns:
+        days (np.ndarray): the day of each trip.
+        weekend (np.ndarray): whether each day is a weekend day.
+    """
+
+    dates = FIRST_DAY + np.arange(MONTH_DAYS.sum())
+    weekend = pd.DatetimeIndex(dates).dayofweek.to_numpy() >= 5
+    weights = np.repeat(MONTH_WEIGHTS / MONTH_DAYS, MONTH_DAYS)
+    weights *= np.where(weekend, WEEKEND_SHARE / 2, (1 - WEEKEND_SHARE) / 5)
+    return rng.choice(len(dates), n_rows, p=weights / weights.sum()), weekend
+
+
+def generate_trips(city, n_rows, stations, rng):
+    """Draws a chunk of trips shaped like those of a city.
+
+    Stations follow a Zipf popularity law & often end near where they
+    start, start times follow seasonal, weekly & daily cycles and trip
+    durations are log-normal, longer for casual riders.
+
+    Args:
+        city (str): a key of CITY_SHAPES.
+        n_rows (int): the number of trips.
+        stations (np.ndarray): the station names, in popularity order.
+        rng (np.random.Generator): the random generator.
+
+    Returns:
+        trips (pd.DataFrame): the trips, with the columns of the city file.
+    """
+
+    shape = CITY_SHAPES[city]
+    n_stations = len(stations)
+
+    # Start times
+    days, weekend = trip_days(n_rows, rng)
+    is_weekend = weekend[days]
+    hours = np.where(
+        is_weekend,
+        rng.choice(24, n_rows, p=WEEKEND_HOURS / WEEKEND_HOURS.sum()),
+        rng.choice(24, n_rows, p=WEEKDAY_HOURS / WEEKDAY_HOURS.sum()),
+    )
+    seconds = days * 86400 + hours * 3600 + rng.integers(0, 3600, n_rows)
+    start_time = FIRST_DAY.astype("datetime64[s]") + seconds
+
+    # Riders
+    names = list(shape["user_types"])
+    user_type = rng.choice(names, n_rows, p=list(shape["user_types"].values()))
+    casual = user_type == "Customer"
+
+    # Durations, in seconds
+    duration = rng.lognormal(np.where(casual, 7.3, 6.4), 0.6)
+    duration = np.clip(duration, 60, 86400)
+    if shape["whole_seconds"]:
+        duration = np.round(duration)
+    else:
+        duration = np.round(duration, 3)
+    end_time = start_time + (duration * 1000).astype("timedelta64[ms]")
+
+    # Stations, a third of the trips ending at a neighbour of their start
+    popularity = 1 / np.arange(1, n_stations + 1)
+    popularity /= popularity.sum()
+    start = rng.choice(n_stations, n_rows, p=popularity)
+    end = rng.choice(n_stations, n_rows, p=popularity)
+    nearby = rng.random(n_rows) < 1 / 3
+    end[nearby] = (start[nearby]
+                   + rng.integers(-3, 4, nearby.sum())) % n_stations
+
+    trips = pd.DataFrame({
+        "Start Time": start_time,
+        "End Time": end_time.astype("datetime64[s]"),
+        "Trip Duration": duration,
+        "Start Station": stations[start],
+        "End Station": stations[end],
+        "User Type": pd.Series(user_type).mask(
+            rng.random(n_rows) < shape["missing_user_type"]
+        ),
+    })
+
+    if shape["demographics"]:
+        unknown = rng.random(n_rows) < shape["missing_gender"]
+        trips["Gender"] = pd.Series(
+            rng.choice(["Male", "Female"], n_rows, p=[0.75, 0.25])
+        ).mask(unknown | casual & (rng.random(n_rows) < 0.5))
+        age = np.clip(rng.gamma(6, 6, n_rows) + 16, 16, 100).astype(int)
+        trips["Birth Year"] = pd.Series(2017.0 - age).mask(
+            trips["Gender"].isna() & (rng.random(n_rows) < 0.95)
+        )
+    return trips
+
+
+def generate_city(path, city, n_rows, seed=0, chunk_rows=1_000_000):
+    """Writes a synthetic city file, chunk by chunk.
+
+    The file has the layout of the real ones, index column included, so
+    that every reader of the scripts takes it as is.
+
+    Args:
+        path (str): where to write the CSV file.
+        city (str): a key of CITY_SHAPES.
+        n_rows (int): the number of trips.
+        seed (int): the seed of the random generator.
+        chunk_rows (int): the number of trips drawn & written at a time.
+
+    Returns:
+        This function returns nothing.
+    """
+
+    rng = np.random.default_rng(seed)
+    stations = station_names(CITY_SHAPES[city]["stations"], rng)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    # Write to a temporary file, so an interrupted run leaves no file
+    with open(f"{path}.tmp", "w", newline="") as file:
+        for first in range(0, n_rows, chunk_rows):
+            trips = generate_trips(city, min(chunk_rows, n_rows - first),
+                                   stations, rng)
+            trips.index += first
+            trips.to_csv(file, header=first == 0)
+    os.replace(f"{path}.tmp", path)
+
+
+def parse_args(argv=None):
+    """Reads the command line options.
+
+    Args:
+        argv (list): the arguments, those of the script if not given.
+
+    Returns:
+        args (argparse.Namespace): the parsed options.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Write synthetic city files shaped like the real ones.",
+    )
+    parser.add_argument(
+        "--rows", type=lambda n: int(float(n)), default=100_000,
+        help="the number of trips of each file, e.g. 1e6",
+    )
+    parser.add_argument(
+        "--cities", nargs="+", type=str.title, choices=CITY_SHAPES,
+        default=list(CITY_SHAPES), metavar="CITY",
+        help="the cities to write, all of them if not given",
+    )
+    parser.add_argument(
+        "--folder", default="./data",
+        help="where to write the files, named as in CITIES",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for city in args.cities:
+        path = os.path.join(args.folder,
+                            os.path.basename(bikeshare.CITIES[city]))
+        print(f"Writing {args.rows} trips to {path}..")
+        generate_city(path, city, args.rows, args.seed)
+    print("Done!")